@@ -4,7 +4,7 @@ from enum import Enum
 import numpy as np
 import torch
 
-from mafia_game.common import Check, Role, Team
+from mafia_game.common import BLACK_ROLES, Check, Role, Team
 
 
 # TODO: Add serialization to vector
@@ -14,7 +14,19 @@ class InputTypes(Enum):
     INDEX = 1
 
 
+def alive_target_mask(game_state: "CompleteGameState", player_index):
+    """
+    Mask with 1 for every alive player other than player_index.
+    Built from one list so torch does not get a write per player.
+    """
+    mask = [float(state.alive) for state in game_state.game_states]
+    mask[player_index] = 0.0
+    return torch.tensor(mask, dtype=torch.float32)
+
+
 class FromIndexTargetPlayerMixin:
+    __slots__ = ()
+
     @classmethod
     def from_index(cls, action_index, game_state, player_index):
         # Create an instance of NominationAction using the action_index
@@ -22,6 +34,9 @@ class FromIndexTargetPlayerMixin:
 
 
 class Action(ABC):
+    # A new action is created for every move, so actions carry no __dict__
+    __slots__ = ("player_index",)
+
     action_size = 10
     red_team = True
     black_team = True
@@ -43,6 +58,7 @@ class Action(ABC):
 
 
 class BeliefAction(Action):
+    __slots__ = ("beliefs",)
     action_size = 30
 
     input_type = InputTypes.VECTOR
@@ -52,9 +68,11 @@ class BeliefAction(Action):
         self.beliefs = beliefs
 
     def apply(self, game_state: "CompleteGameState"):
+        # Copied into the turn's row, beliefs may be a Check or a plain
+        # sequence of team values
         game_state.game_states[self.player_index].public_data.beliefs.checks[
             game_state.turn
-        ] = self.beliefs
+        ][:] = getattr(self.beliefs, "checks", self.beliefs)
 
     @staticmethod
     def normalize_vector(output_vector):
@@ -78,6 +96,7 @@ class BeliefAction(Action):
 
 
 class KillAction(Action, FromIndexTargetPlayerMixin):
+    __slots__ = ("target_player",)
     red_team = False
 
     def __init__(self, player_index, target_player):
@@ -98,15 +117,12 @@ class KillAction(Action, FromIndexTargetPlayerMixin):
 
     @classmethod
     def generate_action_mask(cls, game_state: "CompleteGameState", player_index):
-        mask = torch.ones(cls.action_size, dtype=torch.float32)
-        for i, player_state in enumerate(game_state.game_states):
-            if not player_state.alive or i == player_index:
-                mask[i] = 0
-
-        return mask
+        return alive_target_mask(game_state, player_index)
 
 
 class NominationAction(Action, FromIndexTargetPlayerMixin):
+    __slots__ = ("target_player",)
+
     def __init__(self, player_index, target_player):
         self.player_index = player_index
         self.target_player = target_player
@@ -121,18 +137,14 @@ class NominationAction(Action, FromIndexTargetPlayerMixin):
 
     @classmethod
     def generate_action_mask(cls, game_state: "CompleteGameState", player_index):
-        mask = torch.ones(cls.action_size, dtype=torch.float32)
-        for i, player_state in enumerate(game_state.game_states):
-            if not player_state.alive or i == player_index:
-                mask[i] = 0
-
-        return mask
+        return alive_target_mask(game_state, player_index)
 
     def __repr__(self):
         return f"Player {self.player_index}. Nominates: {self.target_player}"
 
 
 class DonCheckAction(Action, FromIndexTargetPlayerMixin):
+    __slots__ = ("target_player",)
     red_team = False
 
     def __init__(self, player_index, target_player):
@@ -162,6 +174,7 @@ class DonCheckAction(Action, FromIndexTargetPlayerMixin):
 
 
 class SheriffCheckAction(Action, FromIndexTargetPlayerMixin):
+    __slots__ = ("target_player",)
     black_team = False
 
     def __init__(self, player_index, target_player):
@@ -171,7 +184,7 @@ class SheriffCheckAction(Action, FromIndexTargetPlayerMixin):
     def apply(self, game_state: "CompleteGameState"):
         # The check result is the team of the target player
         check_result = game_state.game_states[self.target_player].private_data.role
-        if check_result == Role.MAFIA or check_result == Role.DON:
+        if check_result in BLACK_ROLES:
             check_result = Team.BLACK_TEAM
         else:
             check_result = Team.RED_TEAM
@@ -185,6 +198,7 @@ class SheriffCheckAction(Action, FromIndexTargetPlayerMixin):
 
 
 class SheriffDeclarationAction(Action):
+    __slots__ = ("i_am_sheriff",)
     action_size = 2
 
     def __init__(self, player_index, i_am_sheriff: bool):
@@ -209,6 +223,7 @@ class SheriffDeclarationAction(Action):
 
 
 class PublicSheriffDeclarationAction(Action):
+    __slots__ = ("target_player", "role")
     action_size = 20
 
     def __init__(self, player_index, target_player: int, team: Team):
@@ -241,6 +256,8 @@ class PublicSheriffDeclarationAction(Action):
 
 
 class VoteAction(Action, FromIndexTargetPlayerMixin):
+    __slots__ = ("target_player",)
+
     def __init__(self, player_index, target_player):
         self.player_index = player_index
         self.target_player = target_player
@@ -254,10 +271,10 @@ class VoteAction(Action, FromIndexTargetPlayerMixin):
     def generate_action_mask(cls, game_state: "CompleteGameState", player_index):
         # This mask is different, votes are disabled by default
         # and only voting for nominated players is allowed
-        mask = torch.zeros(cls.action_size, dtype=torch.float32)
+        mask = [0.0] * cls.action_size
         for index in game_state.nominated_players:
-            mask[index] = 1
-        return mask
+            mask[index] = 1.0
+        return torch.tensor(mask, dtype=torch.float32)
 
     def __repr__(self):
         return f"Player {self.player_index}. Votes: {self.target_player}"
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field, fields
-from enum import Enum
+from functools import lru_cache
+from enum import Enum, IntEnum
 from typing import Type, TypeVar
 
 import numpy as np
@@ -7,9 +8,16 @@ import numpy as np
 MAX_TURNS = 10
 MAX_PLAYERS = 10
 ARRAY_SIZE = 715
+# Every serialized value is a small integer (player index, role, team, flag),
+# so the per-player arrays are stored compactly with this fixed dtype
+STATE_DTYPE = np.int8
 
 
-class Role(Enum):
+class Role(IntEnum):
+    # Members compare and hash as plain ints, but still print as Role.NAME
+    __str__ = Enum.__str__
+    __format__ = Enum.__format__
+
     CITIZEN = 0
     SHERIFF = 1
     MAFIA = 2
@@ -17,37 +25,75 @@ class Role(Enum):
     UNKNOWN = 4
 
 
-class Team(Enum):
+# Precomputed team membership of each role; hashed lookups replace
+# building a two-element list on every check
+BLACK_ROLES = frozenset((Role.MAFIA, Role.DON))
+RED_ROLES = frozenset((Role.CITIZEN, Role.SHERIFF))
+
+
+class Team(IntEnum):
+    __str__ = Enum.__str__
+    __format__ = Enum.__format__
+
     UNKNOWN = 0
     BLACK_TEAM = 1
     RED_TEAM = 2
 
 
+# Team of every role as one dict lookup; roles outside the black team,
+# UNKNOWN included, play for the red team
+ROLE_TEAMS = {
+    role: Team.BLACK_TEAM if role in BLACK_ROLES else Team.RED_TEAM for role in Role
+}
+
+
+@lru_cache(maxsize=None)
+def field_names(cls):
+    # Dataclass fields never change after class creation
+    return tuple(field.name for field in fields(cls))
+
+
 class SerializeMixin:
+    __slots__ = ()
+
     def serialize(self):
         serialized_data = []
-        for field in fields(self):
-            field_value = getattr(self, field.name)
-            if hasattr(field_value, "serialize"):
+        self.collect_serialized(serialized_data)
+        return np.concatenate(serialized_data)
+
+    def collect_serialized(self, serialized_data):
+        # Appends the arrays of every field, descending into nested dataclasses
+        # that serialize the default way, so the caller concatenates only once
+        for name in field_names(type(self)):
+            field_value = getattr(self, name)
+            if (
+                isinstance(field_value, SerializeMixin)
+                and type(field_value).serialize is SerializeMixin.serialize
+            ):
+                field_value.collect_serialized(serialized_data)
+            elif hasattr(field_value, "serialize"):
                 serialized_data.append(field_value.serialize())
             elif isinstance(field_value, np.ndarray) or isinstance(field_value, list):
                 serialized_data.append(field_value)
             elif isinstance(field_value, Enum):
-                serialized_data.append([field_value.value])
-            elif isinstance(field_value, int):
-                serialized_data.append([field_value])
+                serialized_data.append(np.array([field_value.value], dtype=STATE_DTYPE))
+            elif isinstance(field_value, (int, np.integer)):
+                serialized_data.append(np.array([field_value], dtype=STATE_DTYPE))
             else:
                 raise TypeError(
-                    f"Cannot serialize field '{field.name}' of type {type(field_value)}"
+                    f"Cannot serialize field '{name}' of type {type(field_value)}"
                 )
-        return np.concatenate(serialized_data)
 
 
 T = TypeVar("T", bound="DeserializeMixin")
 
 
 class DeserializeMixin:
+    __slots__ = ()
+
+    # A class's layout is fixed, so its size is computed only once
     @classmethod
+    @lru_cache(maxsize=None)
     def expected_size(cls):
         sum_of_all_sizes = 0
         for field in fields(cls):
@@ -101,15 +147,20 @@ class DeserializeMixin:
     def deserialize_with_index(
         cls: Type[T], serialized_data: np.ndarray, start_idx: int
     ) -> (T, int):
-        instance = cls.deserialize(
-            serialized_data[start_idx : start_idx + cls.expected_size()]
-        )
-        return instance, start_idx + cls.expected_size()
+        end_idx = start_idx + cls.expected_size()
+        instance = cls.deserialize(serialized_data[start_idx:end_idx])
+        return instance, end_idx
 
 
 class Check(SerializeMixin, DeserializeMixin):
-    def __init__(self):
-        self.checks = np.zeros(MAX_PLAYERS)
+    # Every Checks holds one Check per turn, so they go without a __dict__
+    __slots__ = ("checks",)
+
+    def __init__(self, checks=None):
+        # An existing row is used as is, without copying
+        if checks is None:
+            checks = np.zeros(MAX_PLAYERS, dtype=STATE_DTYPE)
+        self.checks = checks
 
     def __setitem__(self, key, value):
         self.checks[key] = value
@@ -126,17 +177,17 @@ class Check(SerializeMixin, DeserializeMixin):
 
     @classmethod
     def deserialize(cls: Type[T], serialized_data: np.ndarray) -> T:
-        check = cls()
-        check.checks = serialized_data
-        return check
+        return cls(np.asarray(serialized_data, dtype=STATE_DTYPE))
 
     def __repr__(self):
         return f"{self.__class__.__name__}({[Team(v) for v in self.serialize()]})"
 
 
 class Booleans(SerializeMixin, DeserializeMixin):
+    __slots__ = ("values",)
+
     def __init__(self):
-        self.values = np.zeros(MAX_PLAYERS)
+        self.values = np.zeros(MAX_PLAYERS, dtype=STATE_DTYPE)
 
     def __setitem__(self, key, value):
         self.values[key] = value
@@ -154,7 +205,7 @@ class Booleans(SerializeMixin, DeserializeMixin):
             )
 
         booleans = Booleans()
-        booleans.values = serialized_booleans
+        booleans.values = np.asarray(serialized_booleans, dtype=STATE_DTYPE)
         return booleans
 
     @classmethod
@@ -175,32 +226,49 @@ class Checks(SerializeMixin, DeserializeMixin):
 
     def __post_init__(self):
         self._next_index = 0
+        # All turns live in one contiguous (turns, players) array and every
+        # Check is a view of its row, so serializing needs no concatenation
+        self.values = np.array(
+            [check.checks for check in self.checks], dtype=STATE_DTYPE
+        ).reshape(len(self.checks), MAX_PLAYERS)
+        for index, check in enumerate(self.checks):
+            check.checks = self.values[index]
+
+    def _bind(self, index, check):
+        self.values[index] = check.checks
+        check.checks = self.values[index]
+
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        # Copies and unpickling duplicate every row on its own, so the rows
+        # are made views of values again for writes to reach serialize()
+        self.__dict__.update(state)
+        for index, check in enumerate(self.checks):
+            check.checks = self.values[index]
 
     def add_check(self, check: Check):
         if not isinstance(check, Check):
             raise ValueError("Only Check instances can be added")
         if self._next_index >= len(self.checks):
             raise ValueError("All slots are occupied")
+        self._bind(self._next_index, check)
         self.checks[self._next_index] = check
         self._next_index += 1
 
     def serialize(self):
-        return np.concatenate([c.serialize() for c in self.checks])
+        return self.values.reshape(-1)
 
     @classmethod
     def deserialize(cls: Type[T], serialized_data: np.ndarray) -> T:
-        check_length = MAX_PLAYERS
-        num_checks = len(serialized_data) // check_length
-        checks = []
-
-        for i in range(num_checks):
-            # Extract the serialized data for a single check
-            check_data = serialized_data[i * check_length : (i + 1) * check_length]
-            # Assuming Check has a deserialize method that accepts a NumPy array
-            check = Check.deserialize(check_data)
-            checks.append(check)
-
-        return cls(checks=checks)
+        # One row per whole check; the rows are copied into the new instance's
+        # values in one go, so each Check only wraps its row
+        num_checks = len(serialized_data) // MAX_PLAYERS
+        rows = np.asarray(
+            serialized_data[: num_checks * MAX_PLAYERS], dtype=STATE_DTYPE
+        ).reshape(num_checks, MAX_PLAYERS)
+        return cls(checks=[Check(row) for row in rows])
 
     @classmethod
     def expected_size(cls):
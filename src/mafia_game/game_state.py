@@ -3,6 +3,7 @@ from dataclasses import dataclass, field
 from typing import List, Type
 
 import numpy as np
+import torch
 
 from mafia_game.actions import (
     BeliefAction,
@@ -16,6 +17,7 @@ from mafia_game.actions import (
 )
 from mafia_game.common import (
     ARRAY_SIZE,
+    BLACK_ROLES,
     Beliefs,
     Booleans,
     Checks,
@@ -23,7 +25,10 @@ from mafia_game.common import (
     MAX_PLAYERS,
     MAX_TURNS,
     Nominations,
+    RED_ROLES,
+    ROLE_TEAMS,
     Role,
+    STATE_DTYPE,
     SerializeMixin, T, Team,
     Votes,
     )
@@ -33,7 +38,9 @@ from mafia_game.logger import logger
 @dataclass
 class OtherMafias(SerializeMixin, DeserializeMixin):
 
-    other_mafias: np.array = field(default_factory=lambda: np.array([-1, -1, -1]))
+    other_mafias: np.array = field(
+        default_factory=lambda: np.full(3, -1, dtype=STATE_DTYPE)
+    )
 
     @classmethod
     def expected_size(cls):
@@ -44,7 +51,9 @@ class OtherMafias(SerializeMixin, DeserializeMixin):
 
     @classmethod
     def deserialize(cls: Type[T], serialized_data: np.ndarray) -> T:
-        return OtherMafias(other_mafias=serialized_data)
+        return OtherMafias(
+            other_mafias=np.asarray(serialized_data, dtype=STATE_DTYPE)
+        )
 
 @dataclass
 class PrivateData(SerializeMixin, DeserializeMixin):
@@ -55,9 +64,7 @@ class PrivateData(SerializeMixin, DeserializeMixin):
 
     @property
     def team(self):
-        if self.role == Role.DON or self.role == Role.MAFIA:
-            return Team.BLACK_TEAM
-        return Team.RED_TEAM
+        return ROLE_TEAMS[self.role]
 
 
 @dataclass
@@ -84,7 +91,8 @@ class GameState(SerializeMixin, DeserializeMixin):
 
 
 class Phase:
-    allowed_actions = []
+    # Tuples, so they are shared as is and passed straight to isinstance
+    allowed_actions = ()
 
     @staticmethod
     def from_value(value):
@@ -94,13 +102,17 @@ class Phase:
 
     def execute_action(self, game_state: "CompleteGameState", action):
         # Accept only VoteAction during the voting phase
-        if any(isinstance(action, clazz) for clazz in self.allowed_actions):
+        if isinstance(action, self.allowed_actions):
             action.apply(game_state)
         else:
             raise ValueError(
                 f"Action {action.__class__} is not allowed during {self.__class__} phase"
             )
 
+    def available_action_classes(self, game_state: "CompleteGameState"):
+        # Action classes the active player may use during this phase
+        return self.allowed_actions
+
     @abstractmethod
     def next_phase(self, game_state: "CompleteGameState"):
         pass
@@ -109,12 +121,12 @@ class Phase:
 class DayPhase(Phase):
     value = 0
 
-    allowed_actions = [
+    allowed_actions = (
         BeliefAction,
         NominationAction,
         SheriffDeclarationAction,
         PublicSheriffDeclarationAction,
-    ]
+    )
 
     def next_phase(self, game_state: "CompleteGameState"):
         # Transition to the voting phase after all players have taken their actions
@@ -125,14 +137,14 @@ class DayPhase(Phase):
 
 
 class VotingPhase(Phase):
-    allowed_actions = [VoteAction]
+    allowed_actions = (VoteAction,)
     value = 1
 
     def next_phase(self, game_state: "CompleteGameState"):
         # Resolve votes and transition to the night kill phase
         if game_state.nominated_players:
             game_state.resolve_votes()
-            game_state.nominated_players = []
+            game_state.nominated_players.clear()
         else:
             logger.info("Nobody had been nominated. Skipping vote.")
         return NightKillPhase()
@@ -142,9 +154,15 @@ class VotingPhase(Phase):
 
 
 class NightKillPhase(Phase):
-    allowed_actions = [KillAction]
+    allowed_actions = (KillAction,)
     value = 2
 
+    def available_action_classes(self, game_state: "CompleteGameState"):
+        # Mafia and Don decide who to kill, only one of them makes the kill
+        if game_state.index_of_night_killer() == game_state.active_player:
+            return self.allowed_actions
+        return ()
+
     def next_phase(self, game_state: "CompleteGameState"):
         # Resolve votes and transition to the night kill phase
         return NightDonPhase()
@@ -154,9 +172,16 @@ class NightKillPhase(Phase):
 
 
 class NightDonPhase(Phase):
-    allowed_actions = [DonCheckAction]
+    allowed_actions = (DonCheckAction,)
     value = 3
 
+    def available_action_classes(self, game_state: "CompleteGameState"):
+        # Don checks if a player is the Sheriff
+        active_player_state = game_state.game_states[game_state.active_player]
+        if active_player_state.private_data.role == Role.DON:
+            return self.allowed_actions
+        return ()
+
     def next_phase(self, game_state: "CompleteGameState"):
         # Resolve votes and transition to the night kill phase
         return NightSheriffPhase()
@@ -165,9 +190,16 @@ class NightDonPhase(Phase):
         return f"NightDonPhase"
 
 class NightSheriffPhase(Phase):
-    allowed_actions = [SheriffCheckAction]
+    allowed_actions = (SheriffCheckAction,)
     value = 4
 
+    def available_action_classes(self, game_state: "CompleteGameState"):
+        # Sheriff checks a player's allegiance
+        active_player_state = game_state.game_states[game_state.active_player]
+        if active_player_state.private_data.role == Role.SHERIFF:
+            return self.allowed_actions
+        return ()
+
     def next_phase(self, game_state: "CompleteGameState"):
         # Resolve votes and transition to the night kill phase
         return EndPhase()
@@ -177,19 +209,16 @@ class NightSheriffPhase(Phase):
 
 
 class EndPhase(Phase):
-    allowed_actions = []
+    allowed_actions = ()
     value = 5
 
     def next_phase(self, game_state: "CompleteGameState"):
         # Resolve votes and transition to the night kill phase
         game_state.check_end_conditions()
         game_state.turn += 1
-        while True:
-            game_state.active_player += 1
-            if game_state.active_player > 9:
-                game_state.active_player = 0
-            if game_state.game_states[game_state.active_player].alive:
-                break
+        game_state.active_player = game_state.next_alive_player(
+            game_state.active_player
+        )
         return DayPhase()
 
     def __repr__(self):
@@ -214,19 +243,28 @@ class CompleteGameState(SerializeMixin, DeserializeMixin):
     nominated_players: list = field(default_factory=list)
 
     def serialize(self):
-        # Serialize each GameState object and concatenate them
-        game_states = [game_state.serialize() for game_state in self.game_states]
-
-        serialized_state = np.concatenate(
-            [
-                np.concatenate(game_states),
-                np.array([self.active_player]),
-                np.array([self.current_phase.value]),
-                np.array([self.turn]),
-                np.array([self.team_won.value]),
-            ]
+        # Collect the arrays of every GameState and concatenate them once
+        serialized_data = []
+        for game_state in self.game_states:
+            game_state.collect_serialized(serialized_data)
+        serialized_data.append(
+            np.array(
+                [
+                    self.active_player,
+                    self.current_phase.value,
+                    self.turn,
+                    self.team_won.value,
+                ],
+                dtype=STATE_DTYPE,
+            )
         )
-        return serialized_state
+        return np.concatenate(serialized_data)
+
+    def to_tensor(self, device=None):
+        # Serialized state as a (1, state size) float tensor, the network input
+        return torch.as_tensor(
+            self.serialize(), dtype=torch.float32, device=device
+        ).view(1, -1)
 
     def update_turn(self):
         # Update the turn, ensuring it doesn't exceed the maximum number of turns
@@ -282,52 +320,36 @@ class CompleteGameState(SerializeMixin, DeserializeMixin):
         """We combine game_state and action_vector to get new game state"""
         return new_game_state
 
+    def next_alive_player(self, player_index):
+        """
+        Index of the first alive player after player_index, going around the table
+        """
+        for offset in range(1, MAX_PLAYERS + 1):
+            next_index = (player_index + offset) % MAX_PLAYERS
+            if self.game_states[next_index].alive:
+                return next_index
+        return player_index
+
     def index_of_night_killer(self):
         """
-        Determines index of killer
+        Determines index of killer: the Don while alive, otherwise the first
+        alive Mafia, -1 if there is none
         """
         killer = -1
         for i, state in enumerate(self.game_states):
-            if state.private_data.role == Role.MAFIA and state.alive and killer == -1:
-                killer = i
-            if state.private_data.role == Role.DON and state.alive:
+            if not state.alive:
+                continue
+            role = state.private_data.role
+            if role == Role.DON:
+                return i
+            if role == Role.MAFIA and killer == -1:
                 killer = i
         return killer
 
 
     def get_available_action_classes(self):
-        # Get the GameState for the active player
-        active_player_state = self.game_states[self.active_player]
-        active_player_role = active_player_state.private_data.role
-        available_action_classes = []
-
-        if isinstance(self.current_phase, DayPhase):
-            # During the day, all players can make declarations and nominations
-            available_action_classes.append(BeliefAction)
-            available_action_classes.append(NominationAction)
-            available_action_classes.append(SheriffDeclarationAction)
-            available_action_classes.append(PublicSheriffDeclarationAction)
-
-        elif isinstance(self.current_phase, VotingPhase):
-            # During the voting phase, players vote for nominated players
-            available_action_classes.append(VoteAction)
-
-        elif isinstance(self.current_phase, NightKillPhase):
-            if self.index_of_night_killer() == self.active_player:
-                # Mafia and Don decide who to kill
-                available_action_classes.append(KillAction)
-
-        elif isinstance(self.current_phase, NightDonPhase):
-            if active_player_role == Role.DON:
-                # Don checks if a player is the Sheriff
-                available_action_classes.append(DonCheckAction)
-
-        elif isinstance(self.current_phase, NightSheriffPhase):
-            if active_player_role == Role.SHERIFF:
-                # Sheriff checks a player's allegiance
-                available_action_classes.append(SheriffCheckAction)
-
-        return available_action_classes
+        # Dispatch on the phase object instead of testing every phase class
+        return self.current_phase.available_action_classes(self)
 
     def execute_action(self, action):
         self.current_phase.execute_action(self, action)
@@ -336,18 +358,23 @@ class CompleteGameState(SerializeMixin, DeserializeMixin):
         self.current_phase = self.current_phase.next_phase(self)
 
     def resolve_votes(self):
-        # Count the votes for each player
-        vote_counts = np.zeros(MAX_PLAYERS, dtype=int)
-        for player_state in self.game_states:
-            if player_state.alive:  # Only alive players can vote
-                votes = player_state.public_data.votes.checks[self.turn]
-                for target_player, vote in enumerate(votes):
-                    if vote:
-                        vote_counts[target_player] += 1
+        # Count the votes for each player: sum the vote rows of alive players
+        vote_tables = [
+            player_state.public_data.votes.values for player_state in self.game_states
+        ]
+        vote_rows = [
+            vote_table[self.turn]
+            for vote_table, player_state in zip(vote_tables, self.game_states)
+            if player_state.alive  # Only alive players can vote
+        ]
+        if vote_rows:
+            vote_counts = np.add.reduce(vote_rows, axis=0, dtype=int)
+        else:
+            vote_counts = np.zeros(MAX_PLAYERS, dtype=int)
 
         # Determine if a player has been voted out
-        max_votes = np.max(vote_counts)
-        players_with_max_votes = np.where(vote_counts == max_votes)[0]
+        max_votes = vote_counts.max()
+        players_with_max_votes = np.flatnonzero(vote_counts == max_votes)
 
         if len(players_with_max_votes) == 1:
             # If there is a clear player with the most votes, eliminate that player
@@ -359,8 +386,8 @@ class CompleteGameState(SerializeMixin, DeserializeMixin):
         # If there is a tie or no one received votes, no one is eliminated
 
         # Clear the votes for the next round
-        for player_state in self.game_states:
-            player_state.public_data.votes.checks[self.turn].checks.fill(0)
+        for vote_table in vote_tables:
+            vote_table[self.turn] = 0
 
     def check_end_conditions(self):
         # Count the number of alive players for each team
@@ -368,9 +395,9 @@ class CompleteGameState(SerializeMixin, DeserializeMixin):
         black_team_count = 0
         for state in self.game_states:
             if state.alive:
-                if state.private_data.role in [Role.CITIZEN, Role.SHERIFF]:
+                if state.private_data.role in RED_ROLES:
                     red_team_count += 1
-                elif state.private_data.role in [Role.MAFIA, Role.DON]:
+                elif state.private_data.role in BLACK_ROLES:
                     black_team_count += 1
 
         # Check winning conditions
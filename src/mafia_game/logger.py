@@ -1,4 +1,7 @@
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
 
 logging.getLogger().setLevel(logging.INFO)
 
@@ -17,7 +20,15 @@ f_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message
 c_handler.setFormatter(c_format)
 f_handler.setFormatter(f_format)
 
+# File writes go through a queue drained by a background thread,
+# so the game loop never blocks on disk I/O
+log_queue = Queue(-1)
+q_handler = QueueHandler(log_queue)
+q_handler.setLevel(f_handler.level)
+listener = QueueListener(log_queue, f_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
 # Add handlers to the logger
 logger.addHandler(c_handler)
-logger.addHandler(f_handler)
-
+logger.addHandler(q_handler)
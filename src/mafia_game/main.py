@@ -1,4 +1,6 @@
 import os
+from contextlib import nullcontext
+
 import torch
 import torch.optim as optim
 import torch.nn.functional as F
@@ -14,6 +16,8 @@ GAMMA = 0.99  # Discount factor for future rewards
 SAVE_INTERVAL = 100  # Save the model every 100 episodes
 LOG_INTERVAL = 10  # Log progress every 10 episodes
 MODEL_DIR = "models"  # Directory to save models
+# File the loss of every update is written to, only when MAFIA_LOSS_LOG is set
+LOSS_LOG_PATH = os.environ.get("MAFIA_LOSS_LOG")
 
 # Ensure the model directory exists
 os.makedirs(MODEL_DIR, exist_ok=True)
@@ -29,33 +33,33 @@ black_optimizer = optim.Adam(black_network.parameters())
 # Loss function
 loss_function = F.mse_loss
 
-with open(
-        "/home/ANT.AMAZON.COM/zedmor/PycharmProjects/mafia_modeling/src/mafia_game/logs/loss_file.log",
-        "w",
-        ) as loss_file:
-    loss_file.write("Starting session")
-
-# Training loop
-for episode in range(NUM_EPISODES):
-    # Run the training episode
-    train(
-        red_network,
-        black_network,
-        red_optimizer,
-        black_optimizer,
-        loss_function,
-        1,  # Train for 1 episode at a time
-        gamma=GAMMA,
-    )
-
-    # Log progress
-    if episode % LOG_INTERVAL == 0:
-        logger.info(f"Episode {episode}/{NUM_EPISODES} completed.")
-
-    # Save the model
-    if episode % SAVE_INTERVAL == 0:
-        torch.save(red_network.state_dict(), os.path.join(MODEL_DIR, f"red_network_ep{episode}.pth"))
-        torch.save(black_network.state_dict(), os.path.join(MODEL_DIR, f"black_network_ep{episode}.pth"))
-        logger.info(f"Saved models at episode {episode}.")
+# Open for the whole session, train() appends each update's loss to it
+with open(LOSS_LOG_PATH, "w") if LOSS_LOG_PATH else nullcontext() as loss_file:
+    if loss_file is not None:
+        loss_file.write("Starting session")
+
+    # Training loop
+    for episode in range(NUM_EPISODES):
+        # Run the training episode
+        train(
+            red_network,
+            black_network,
+            red_optimizer,
+            black_optimizer,
+            loss_function,
+            1,  # Train for 1 episode at a time
+            gamma=GAMMA,
+            loss_log=loss_file,
+        )
+
+        # Log progress
+        if episode % LOG_INTERVAL == 0:
+            logger.info(f"Episode {episode}/{NUM_EPISODES} completed.")
+
+        # Save the model
+        if episode % SAVE_INTERVAL == 0:
+            torch.save(red_network.state_dict(), os.path.join(MODEL_DIR, f"red_network_ep{episode}.pth"))
+            torch.save(black_network.state_dict(), os.path.join(MODEL_DIR, f"black_network_ep{episode}.pth"))
+            logger.info(f"Saved models at episode {episode}.")
 
 logger.info("Training completed.")
@@ -20,20 +20,16 @@ class BaseDQNNetwork(nn.Module):
         )
         self.action_types = action_types
 
-    def forward(
-        self, game_state, action_type_index, mask=None):
-        serialized_game_state = torch.tensor(
-            game_state.serialize(), dtype=torch.float32
-            ).view(1, -1)
-        serialized_game_state = serialized_game_state.to(self.base[0].weight.device)
-        base_output = self.base(serialized_game_state)
+    def forward(self, state_tensor, action_type_index, mask=None):
+        # state_tensor is a batch of serialized game states, see
+        # CompleteGameState.to_tensor
+        base_output = self.base(state_tensor.to(self.base[0].weight))
 
         head_output = self.heads[action_type_index](base_output)
-        # Use torch.where to apply the mask with -inf for masked actions
-        masked_output = torch.where(mask == 1, head_output,
-                                    torch.tensor(float('-inf')).to(head_output.device))
-
-        return masked_output
+        if mask is None:
+            return head_output
+        # Masked actions get -inf without building a host-side constant
+        return head_output.masked_fill(mask.to(head_output.device) != 1, float('-inf'))
 
 
 class RedDQNNetwork(BaseDQNNetwork):
@@ -62,30 +58,40 @@ class BlackDQNNetwork(BaseDQNNetwork):
 
 
 # Define a function to select an action using the network output
-def select_action(network, game_state_instance, action_type, player_index, epsilon=0.1):
+def select_action(
+    network, game_state_instance, action_type, player_index, epsilon=0.1, rng=random
+):
     action_type_index = network.action_types.index(action_type)
     mask = action_type.generate_action_mask(game_state_instance, player_index)
-    output = network(game_state_instance, action_type_index, mask)
+    output = network(
+        game_state_instance.to_tensor(network.base[0].weight.device),
+        action_type_index,
+        mask,
+    )
 
     if action_type.input_type == InputTypes.VECTOR:
         # If the action expects a vector, use the entire output (e.g., for BeliefAction)
 
-        random_vector = torch.randint(0, 3, (action_type.action_size,))
-        action_data = random_vector if random.random() < epsilon else output
+        if rng.random() < epsilon:
+            action_data = torch.randint(0, 3, (action_type.action_size,))
+        else:
+            action_data = output
         return action_type.from_output_vector(
             action_data, game_state_instance, player_index
         ), action_type.normalize_vector(action_data)
 
     elif action_type.input_type == InputTypes.INDEX:
         # If the action expects an index, select one based on the output probabilities
-        if random.random() < epsilon:
-            # Exploration: Randomly select a valid action index
-            valid_actions = output.nonzero(as_tuple=False).reshape(
-                -1
-            )  # Flatten the tensor to 1D
+        if rng.random() < epsilon:
+            # Exploration: Randomly select a valid (unmasked) action index.
+            # The draw is made on the output's device by inverting the running
+            # count of valid actions, so only the final .item() syncs
+            valid_counts = torch.isfinite(output).reshape(-1).cumsum(0)
             action_index = (
-                random.choice(valid_actions).item() if valid_actions.numel() > 0 else 0
+                (valid_counts <= rng.random() * valid_counts[-1]).sum().item()
             )
+            if action_index == valid_counts.numel():
+                action_index = 0  # No valid actions at all
         else:
             # Exploitation: Select the action index with the highest probability
             action_index = output.argmax().item()  # Use argmax for 1D tensor
@@ -1,13 +1,20 @@
+import logging
 from enum import Enum
 
+import numpy as np
 import torch
 
 from mafia_game.logger import logger
 
 
 class IndexedEnum(Enum):
+    def __init__(self, *args):
+        # Members are created in definition order, so the ones made so far
+        # give this member's position
+        self._index = len(self.__class__._member_names_)
+
     def index(self):
-        return list(self.__class__.__members__).index(self.name)
+        return self._index
 
 
 class Role(IndexedEnum):
@@ -30,6 +37,20 @@ class Team(IndexedEnum):
     BLACK = "Black"
 
 
+NUM_ROLES = len(Role)
+NUM_ACTION_TYPES = len(GameActionType)
+# Members by index(), to read enums back from the action log columns
+ROLES = list(Role)
+ACTION_TYPES = list(GameActionType)
+
+# One-hot prefix of get_state_vector, by the name of the action being taken
+ACTION_TYPE_ONE_HOTS = {
+    name: np.eye(4, dtype=np.uint8)[i]
+    for i, name in enumerate(("make_declarations", "vote", "kill", "nominate_player"))
+}
+VOTE_RESULT_INDEX = GameActionType.VOTE_RESULT.index()
+
+
 class GameAction:
     def __init__(self, action_type, player, target=None, belief=None):
         self.action_type = action_type
@@ -74,33 +95,51 @@ class Player:
     def __init__(self, _id, role, policy):
         self.id = _id
         self.role = role
+        self.team = Team.RED if role == Role.CITIZEN else Team.BLACK
         self.is_alive = True
         self.policy = policy
         self.reward = 0
         self.cumulative_reward = 0
         self.action_vector = None
+        # (action vector, state vector, action count) by action type, for
+        # actions whose vector was computed in a batch ahead of the turn
+        self.prefetched_actions = {}
+        # Reused on every action, the agent copies what it stores. Action
+        # vectors differ in size, so there is one buffer per action type
+        self._action_buffers = {}
+        self._reward_buffer = torch.zeros(1)
         self.learner = False
 
     def __hash__(self):
         return self.id
 
-    @property
-    def team(self):
-        if self.role == Role.CITIZEN:
-            return Team.RED
-        if self.role == Role.MAFIA:
-            return Team.BLACK
-
     def __eq__(self, other):
         return self.id == other.id
 
     def __repr__(self):
         return f"{self.id} ({self.role.value}) with policy: {self.policy}"
 
+    def action_buffer(self, action_type, size):
+        # Zeroed action vector of this player for action_type
+        buffer = self._action_buffers.get(action_type)
+        if buffer is None:
+            buffer = self._action_buffers[action_type] = torch.zeros(size)
+        return buffer.zero_()
+
     def action(self, action_type, game_state, agent):
-        old_state_vector = game_state.get_state_vector(self, action_type)
+        learning = agent and self.learner
+        if learning:
+            prefetched = self.prefetched_actions.get(action_type)
+            if prefetched is None:
+                old_state_vector = game_state.get_state_vector(self, action_type)
+                old_action_count = len(game_state.game_actions)
+            else:
+                # A prefetched action was chosen on the state it was prefetched
+                # from, so that state is the old state of the transition
+                _, old_state_vector, old_action_count = prefetched
 
-        self.action_vector = torch.zeros(94)
+        # Policies that learn set it to the vector of the action they take
+        self.action_vector = None
         result = getattr(self, action_type)(game_state)
 
         winner = game_state.determine_winner()
@@ -112,12 +151,14 @@ class Player:
 
         self.cumulative_reward += self.reward
 
-        if agent and self.action_vector is not None and self.learner:
+        if learning and self.action_vector is not None:
             agent.store_experience(
                 old_state_vector,
                 self.action_vector,
-                game_state.get_state_vector(self, action_type),
-                torch.tensor([self.reward]),
+                game_state.get_state_vector_since(
+                    self, action_type, old_state_vector, old_action_count
+                ),
+                self._reward_buffer.fill_(self.reward),
                 action_type
             )
             agent.update_policy(32, action_type, winner, self.cumulative_reward)
@@ -143,7 +184,7 @@ class Player:
         if (
             nomination
             and nomination.is_alive
-            and nomination not in game_state.nominated_players
+            and not game_state.is_nominated(nomination)
         ):
             if self.team == Team.RED:
                 if nomination.team == Team.BLACK:
@@ -154,7 +195,7 @@ class Player:
             game_state.game_actions.append(
                 GameAction(GameActionType.NOMINATION, self, nomination)
             )
-            game_state.nominated_players.append(nomination)
+            game_state.nominate(nomination)
 
     def vote(self, game_state):
         self.reward = 0
@@ -182,6 +223,44 @@ class Player:
                 player.action("make_declarations", game_state, agent)
 
 
+def prefetch_action_vectors(game_states, action_type):
+    """
+    Runs one batched forward pass per policy for all alive players of the given
+    games about to take action_type, instead of one forward pass per decision.
+    Each player keeps its state vector and the log length it was taken at,
+    as the old state of the transition. Players that already hold a
+    prefetched vector and policies without get_action_vectors are left alone.
+    """
+    requests_by_policy = {}
+    for game_state in game_states:
+        for player in game_state.players:
+            if (
+                player.is_alive
+                and hasattr(player.policy, "get_action_vectors")
+                and action_type not in player.prefetched_actions
+            ):
+                requests_by_policy.setdefault(player.policy, []).append(
+                    (game_state, player)
+                )
+
+    for policy, requests in requests_by_policy.items():
+        # Each state is written straight into its row of the batch
+        state_vectors = torch.empty(
+            (len(requests), requests[0][0].state_vector_size()), dtype=torch.uint8
+        )
+        for (game_state, p), row in zip(requests, state_vectors):
+            game_state.get_state_vector(p, action_type, out=row)
+        action_vectors = policy.get_action_vectors(state_vectors, action_type)
+        for (game_state, player), state_vector, action_vector in zip(
+            requests, state_vectors, action_vectors
+        ):
+            player.prefetched_actions[action_type] = (
+                action_vector,
+                state_vector,
+                len(game_state.game_actions),
+            )
+
+
 class GameController:
     def __init__(self, game_state, agent=None):
         self.game_state = game_state
@@ -193,19 +272,32 @@ class GameController:
         return self.game_state.determine_winner()
 
     def play_round(self):
+        self.start_round()
+        self.end_round()
+
+    def start_round(self):
+        # Plays the round up to the vote, or the whole night
         if self.game_state.day:
-            logger.info(f"\nStarting round: {self.game_state.round}")
-            players = [p for p in self.game_state.players if p.is_alive]
-            logger.info(f"Remaining: {len(players)}")
-            logger.info(f"Players: {players}")
-            self.day_phase()
+            # Formatting every player is skipped entirely in training runs,
+            # where the logger is at ERROR
+            if logger.isEnabledFor(logging.INFO):
+                players = self.game_state.alive_players
+                logger.info(f"\nStarting round: {self.game_state.round}")
+                logger.info(f"Remaining: {len(players)}")
+                logger.info(f"Players: {players}")
+            self.game_state.clear_nominations()
+            self.declaration_phase()
         else:
             self.night_phase()
             self.game_state.round += 1
+
+    def end_round(self):
+        if self.game_state.day:
+            self.voting_phase()
         self.game_state.day = not self.game_state.day
 
     def day_phase(self):
-        self.game_state.nominated_players = []
+        self.game_state.clear_nominations()
         self.declaration_phase()
         self.voting_phase()
 
@@ -223,9 +315,16 @@ class GameController:
             if self.game_state.current_player_index == start_player_index:
                 break
 
+    def prefetch_action_vectors(self, action_type):
+        prefetch_action_vectors([self.game_state], action_type)
+
     def voting_phase(self):
         votes = {player: 0 for player in self.game_state.nominated_players}
         logger.info(f"On the vote: {self.game_state.nominated_players}")
+        # Votes are simultaneous: every voter decides on the state at the
+        # start of the vote, without seeing the votes cast before its own, so
+        # all of them come from a single batched forward pass
+        self.prefetch_action_vectors("vote")
         # TODO: Fix voting according to the rules
         for player in self.game_state.players:
             if player.is_alive:
@@ -245,21 +344,95 @@ class GameController:
             player_to_eliminate.make_declarations(self.game_state)
 
     def night_phase(self):
-        for player in self.game_state.players:
-            if player.is_alive and player.role == Role.MAFIA:
-                player.night_action(self.game_state, self.agent)
+        # The first alive mafia in seat order acts, found as the lowest set
+        # bit of the alive mafia bitset
+        alive_mafia = self.game_state.alive_mask & self.game_state.mafia_mask
+        if alive_mafia:
+            player = self.game_state.players[(alive_mafia & -alive_mafia).bit_length() - 1]
+            player.night_action(self.game_state, self.agent)
+
+
+class BatchedGameController:
+    """
+    Plays several games in lockstep, one round at a time, so that the votes of
+    all games are evaluated by a single batched forward pass per policy
+    """
+
+    def __init__(self, game_states, agent=None):
+        self.controllers = [GameController(game_state, agent) for game_state in game_states]
+
+    def start_games(self):
+        playing = self.controllers
+        while True:
+            playing = [c for c in playing if not c.game_state.check_end_condition()]
+            if not playing:
                 break
+            for controller in playing:
+                controller.start_round()
+            # Every day game is now at the start of its vote, see voting_phase
+            prefetch_action_vectors(
+                [c.game_state for c in playing if c.game_state.day], "vote"
+            )
+            for controller in playing:
+                controller.end_round()
+        return [c.game_state.determine_winner() for c in self.controllers]
+
 
+class GameActionLog:
+    """
+    Append-only log of game actions, stored as int8 columns (-1 stands for
+    None) so the state vector can be built with numpy indexing instead of
+    Python loops. Reading an entry back gives a GameAction view of its row.
+    """
 
-class ListWithEcho(list):
-    def __init__(self, echo=False):
-        super().__init__()
+    def __init__(self, players, echo=False, capacity=128):
+        self.players = players
         self.echo = echo
+        self.n_actions = 0
+        self.action_type_col = np.zeros(capacity, dtype=np.int8)
+        self.player_col = np.zeros(capacity, dtype=np.int8)
+        self.target_col = np.zeros(capacity, dtype=np.int8)
+        self.belief_col = np.zeros(capacity, dtype=np.int8)
+
+    def __len__(self):
+        return self.n_actions
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(self.n_actions))]
+        if row < 0:
+            row += self.n_actions
+        if not 0 <= row < self.n_actions:
+            raise IndexError("game action index out of range")
+        player = self.player_col[row]
+        target = self.target_col[row]
+        belief = self.belief_col[row]
+        return GameAction(
+            ACTION_TYPES[self.action_type_col[row]],
+            self.players[player] if player >= 0 else None,
+            self.players[target] if target >= 0 else None,
+            ROLES[belief] if belief >= 0 else None,
+        )
 
-    def append(self, __object) -> None:
-        super().append(__object)
+    def __iter__(self):
+        return (self[row] for row in range(self.n_actions))
+
+    def append(self, action):
+        row = self.n_actions
+        if row == len(self.action_type_col):
+            self._grow()
+        self.action_type_col[row] = action.action_type.index()
+        self.player_col[row] = action.player.id if action.player else -1
+        self.target_col[row] = action.target.id if action.target else -1
+        self.belief_col[row] = action.belief.index() if action.belief else -1
+        self.n_actions += 1
         if self.echo:
-            logger.info(__object)
+            logger.info(action)
+
+    def _grow(self):
+        for name in ("action_type_col", "player_col", "target_col", "belief_col"):
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate([column, np.zeros_like(column)]))
 
 
 class GameState:
@@ -267,25 +440,74 @@ class GameState:
         self.players = players
         self.day = True
         self.round = 1
-        self.game_actions = ListWithEcho(echo)
+        self.game_actions = GameActionLog(players, echo)
         self.current_player_index = 0
         self.nominated_players = []
+        # Bitsets over player ids (bit i is player i), kept in sync with
+        # is_alive and nominated_players
+        self.alive_mask = (1 << len(players)) - 1
+        self.nominated_mask = 0
+        self.mafia_mask = sum(1 << p.id for p in players if p.role == Role.MAFIA)
+        self.citizen_mask = sum(1 << p.id for p in players if p.role == Role.CITIZEN)
+        # Bit of each player id, and the reused buffers mask_array writes to
+        self._player_bits = 1 << np.arange(len(players))
+        self._mask_bits = np.zeros(len(players), dtype=self._player_bits.dtype)
+        self._mask_buffer = np.zeros(len(players), dtype=bool)
+        # Player block of the state vector, [alive, nominated] per player,
+        # updated along with the bitsets so it never has to be rebuilt
+        self._player_block = np.zeros(2 * len(players), dtype=np.uint8)
+        self._player_block[0::2] = 1
+        # Players by role and liveness in seat order, for policies to draw
+        # from without filtering; kept in sync by eliminate
+        self.citizens = [p for p in players if p.role == Role.CITIZEN]
+        self.alive_players = list(players)
+        self.alive_citizens = list(self.citizens)
+
+    def mask_array(self, mask, invert=False):
+        # Bitset as a boolean array indexed by player id, True where the bit
+        # is clear if invert. The array is reused, it is only valid until the
+        # next call
+        np.bitwise_and(mask, self._player_bits, out=self._mask_bits)
+        compare = np.equal if invert else np.not_equal
+        return compare(self._mask_bits, 0, out=self._mask_buffer)
+
+    def is_nominated(self, player):
+        return bool(self.nominated_mask >> player.id & 1)
 
     def get_next_alive_player_index(self):
-        next_index = (self.current_player_index + 1) % len(self.players)
-        while not self.players[next_index].is_alive:
-            next_index = (next_index + 1) % len(self.players)
-        return next_index
+        # Rotate the alive bitset so the player after the current one is bit 0,
+        # then take the lowest set bit
+        num_players = len(self.players)
+        start = (self.current_player_index + 1) % num_players
+        rotated = (self.alive_mask >> start) | (self.alive_mask << (num_players - start))
+        offset = (rotated & -rotated).bit_length() - 1
+        return (start + offset) % num_players
+
+    def nominate(self, player):
+        self.nominated_players.append(player)
+        self.nominated_mask |= 1 << player.id
+        self._player_block[2 * player.id + 1] = 1
+
+    def clear_nominations(self):
+        self.nominated_players = []
+        self.nominated_mask = 0
+        self._player_block[1::2] = 0
 
     def eliminate(self, player):
-        player.is_alive = False
+        # Eliminating a dead player again leaves the bookkeeping as it is
+        if player.is_alive:
+            player.is_alive = False
+            self.alive_mask &= ~(1 << player.id)
+            self._player_block[2 * player.id] = 0
+            self.alive_players.remove(player)
+            if player.role == Role.CITIZEN:
+                self.alive_citizens.remove(player)
         if player == self.players[self.current_player_index]:
             self.current_player_index = self.get_next_alive_player_index()
 
     def check_end_condition(self):
-        alive_players = [player for player in self.players if player.is_alive]
-        mafia_count = sum(player.role == Role.MAFIA for player in alive_players)
-        citizen_count = sum(player.role == Role.CITIZEN for player in alive_players)
+        mafia_count = (self.alive_mask & self.mafia_mask).bit_count()
+        citizen_count = (self.alive_mask & self.citizen_mask).bit_count()
         if mafia_count >= citizen_count or mafia_count == 0:
             return True
         return False
@@ -300,9 +522,7 @@ class GameState:
     def determine_winner(self):
         if not self.check_end_condition():
             return None  # The game has not ended yet
-        alive_players = [player for player in self.players if player.is_alive]
-        mafia_count = sum(player.role == Role.MAFIA for player in alive_players)
-        if mafia_count == 0:
+        if not self.alive_mask & self.mafia_mask:
             logger.info("Citizens won")
             self.apply_rewards(10, -10)
             return Role.CITIZEN
@@ -317,69 +537,105 @@ class GameState:
             serialized_actions.append(repr(action))
         return serialized_actions
 
-    def get_game_state_vector(self, player, max_actions=100):
-        state_vector = []
-
-        state_vector.append(player.id)
-
-        for p in self.players:
-            state_vector.append(int(p.is_alive))
-            state_vector.append(int(p in self.nominated_players))
-
-        actions = [
-            a
-            for a in self.game_actions[:max_actions]
-            if a.action_type != GameActionType.VOTE_RESULT
-        ]
-        for action in actions:
-            action_type_vector = [0] * len(GameActionType)
-            action_type_vector[action.action_type.index()] = 1
-            state_vector.extend(action_type_vector)
-
-            player_vector = [0] * len(self.players)
-            player_vector[action.player.id] = 1
-            state_vector.extend(player_vector)
-
-            target_vector = [0] * (len(self.players) + 1)
-            if action.target:
-                target_vector[action.target.id] = 1
-            else:
-                target_vector[-1] = 1
-            state_vector.extend(target_vector)
-
-            belief_vector = [0] * (len(Role) + 1)
-            if action.belief:
-                belief_vector[action.belief.index()] = 1
-            else:
-                belief_vector[-1] = 1
-            state_vector.extend(belief_vector)
-
-        action_length = 30
-
-        # Pad the state vector with zeros if there are fewer actions
-        if len(actions) < max_actions:
-            padding = [0] * (max_actions - len(actions)) * action_length
-            state_vector.extend(padding)
-
-        return torch.tensor(state_vector, dtype=torch.float32)
-
-    def get_state_vector(self, player, action_type):
-        # Convert the action type to a one-hot encoded vector
-        action_vector = [0, 0, 0, 0]
-        if action_type == "make_declarations":
-            action_vector[0] = 1
-        elif action_type == "vote":
-            action_vector[1] = 1
-        elif action_type == "kill":
-            action_vector[2] = 1
-        elif action_type == "nominate_player":
-            action_vector[3] = 1
-
-        state_vector = self.get_game_state_vector(player)
-
-        # Concatenate the action vector and state vector
-        full_vector = torch.cat(
-            (torch.tensor(action_vector, dtype=torch.float32), state_vector)
+    def _players_vector(self, player):
+        players_vector = np.empty(1 + 2 * len(self.players), dtype=np.uint8)
+        players_vector[0] = player.id
+        players_vector[1:] = self._player_block
+        return players_vector
+
+    def _action_length(self):
+        return NUM_ACTION_TYPES + 2 * len(self.players) + 1 + NUM_ROLES + 1
+
+    def _fill_action_rows(self, out, start, stop):
+        """
+        Writes one-hot rows for logged actions [start, stop) into out, skipping
+        vote results. Every row is [action type | player | target or none |
+        belief or none]. Returns the number of rows written.
+        """
+        num_players = len(self.players)
+        player_offset = NUM_ACTION_TYPES
+        target_offset = player_offset + num_players
+        belief_offset = target_offset + num_players + 1
+
+        log = self.game_actions
+        kept = log.action_type_col[start:stop] != VOTE_RESULT_INDEX
+        targets = log.target_col[start:stop][kept]
+        beliefs = log.belief_col[start:stop][kept]
+        rows = np.arange(len(targets))
+
+        out[rows, log.action_type_col[start:stop][kept]] = 1
+        out[rows, player_offset + log.player_col[start:stop][kept]] = 1
+        out[rows, target_offset + np.where(targets >= 0, targets, num_players)] = 1
+        out[rows, belief_offset + np.where(beliefs >= 0, beliefs, NUM_ROLES)] = 1
+        return len(rows)
+
+    def _game_state_array(self, player, max_actions, lead=0, out=None):
+        """
+        Game state vector as a uint8 array, preceded by lead unset slots so
+        callers can fill in a prefix without another copy. Every entry is a
+        one-hot flag or a player id, so a byte holds it. Written into out
+        when given, otherwise into a new array.
+        """
+        players_vector = self._players_vector(player)
+        action_length = self._action_length()
+        offset = lead + len(players_vector)
+        if out is None:
+            full_vector = np.zeros(offset + max_actions * action_length, dtype=np.uint8)
+        else:
+            full_vector = out
+            full_vector[offset:] = 0
+        full_vector[lead:offset] = players_vector
+        self._fill_action_rows(
+            full_vector[offset:].reshape(max_actions, action_length),
+            0,
+            min(len(self.game_actions), max_actions),
         )
+        return full_vector
 
+    def get_game_state_vector(self, player, max_actions=100):
+        return torch.from_numpy(self._game_state_array(player, max_actions))
+
+    def get_state_vector_since(
+        self, player, action_type, state_vector, action_count, max_actions=100
+    ):
+        """
+        Same as get_state_vector, but derived from state_vector, which was taken
+        when the log held action_count actions: only the player block and the
+        rows of actions logged since then are rewritten.
+        """
+        n = min(len(self.game_actions), max_actions)
+        start = min(action_count, n)
+        first_row = int(
+            np.count_nonzero(
+                self.game_actions.action_type_col[:start] != VOTE_RESULT_INDEX
+            )
+        )
+        action_length = self._action_length()
+        new_rows = np.zeros((n - start, action_length), dtype=np.uint8)
+        written = self._fill_action_rows(new_rows, start, n)
+
+        players_vector = self._players_vector(player)
+        full_vector = state_vector.clone()
+        offset = 4  # action type one-hot in front of the game state
+        full_vector[offset : offset + len(players_vector)] = torch.as_tensor(
+            players_vector
+        )
+        offset += len(players_vector) + first_row * action_length
+        full_vector[offset : offset + written * action_length] = torch.as_tensor(
+            new_rows[:written].ravel()
+        )
         return full_vector
+
+    def state_vector_size(self, max_actions=100):
+        return 4 + 1 + 2 * len(self.players) + max_actions * self._action_length()
+
+    def get_state_vector(self, player, action_type, out=None):
+        """
+        One-hot encoded action type followed by the game state. With out, a
+        uint8 tensor of state_vector_size(), the vector is written into it.
+        """
+        full_vector = self._game_state_array(
+            player, 100, lead=4, out=None if out is None else out.numpy()
+        )
+        full_vector[:4] = ACTION_TYPE_ONE_HOTS.get(action_type, 0)
+        return torch.from_numpy(full_vector)
@@ -1,6 +1,6 @@
+import copy
 import logging
 import os
-import random
 
 import torch
 import torch.nn as nn
@@ -9,18 +9,28 @@ import torch.optim as optim
 import numpy as np
 
 from mafia_game.logger import logger
-from mafia_game.models import Policy, GameActionType, Role
+from mafia_game.old.models import Policy, GameActionType, Role
 
 INPUT_LAYER_SIZE = 3025
+# Role declared by a declaration index, by (index % 20) // 10
+DECLARED_ROLES = (Role.MAFIA, Role.CITIZEN)
+# (player index, declared role) for each valid index of the declaration head
+DECLARATION_TABLE = tuple((index % 10, DECLARED_ROLES[index % 20 // 10]) for index in range(60))
 MODEL_PATH = f'{os.getcwd()}/../../model_weights/policy_model.pth'
 
 
-if torch.cuda.is_available():
-    device = torch.device('cuda')
-    torch.set_default_tensor_type('torch.cuda.FloatTensor')
-else:
-    device = torch.device('cpu')
-    torch.set_default_tensor_type('torch.FloatTensor')
+# Only the networks and the replay memory live on the device, the small
+# per-step tensors of the game loop stay on the CPU
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# The compiled CUDA forwards have not been run on a GPU yet, so they are
+# only used when MAFIA_COMPILE_NETWORK=1 is set
+COMPILE_NETWORK = os.environ.get('MAFIA_COMPILE_NETWORK') == '1'
+
+
+# Head of MultiHeadNetwork that scores each action type
+HEAD_NAMES = {'make_declarations': 'declaration_head',
+              'vote': 'voting_head',
+              'nominate_player': 'nominating_head'}
 
 
 class MultiHeadNetwork(nn.Module):
@@ -39,28 +49,31 @@ class MultiHeadNetwork(nn.Module):
         self.declaration_head = nn.Sequential(
             nn.Linear(hidden_size, hidden_size),
             nn.ReLU(),
-            nn.Linear(hidden_size, num_players * 2 * 3 + 1),
-            nn.Softmax(dim=1)
+            nn.Linear(hidden_size, num_players * 2 * 3 + 1)
         )
 
         # Voting head
         self.voting_head = nn.Sequential(
             nn.Linear(hidden_size, hidden_size),
             nn.ReLU(),
-            nn.Linear(hidden_size, num_players),
-            nn.Softmax(dim=1)
+            nn.Linear(hidden_size, num_players)
         )
 
         # Nominating head
         self.nominating_head = nn.Sequential(
             nn.Linear(hidden_size, hidden_size),
             nn.ReLU(),
-            nn.Linear(hidden_size, num_players + 1),
-            nn.Softmax(dim=1)
+            nn.Linear(hidden_size, num_players + 1)
         )
 
-    def forward(self, x):
-        shared_out = self.shared_layers(x)
+    def forward(self, x, action_type=None):
+        # Heads return logits: picking actions with argmax/topk needs no
+        # softmax, training applies it where it uses the outputs as Q-values.
+        # State vectors come in as uint8, they are only cast at the input
+        shared_out = self.shared_layers(x.float())
+        if action_type is not None:
+            # Only the head that is asked for is evaluated
+            return getattr(self, HEAD_NAMES[action_type])(shared_out)
 
         declaration_out = self.declaration_head(shared_out)
         voting_out = self.voting_head(shared_out)
@@ -69,6 +82,44 @@ class MultiHeadNetwork(nn.Module):
         return declaration_out, voting_out, nominating_out
 
 
+def drop_output_softmax(network):
+    """
+    Models saved while the heads still ended in nn.Softmax would get softmax
+    applied twice in training, the trailing layer is removed from their heads
+    """
+    for head_name in HEAD_NAMES.values():
+        head = getattr(network, head_name)
+        if isinstance(head[-1], nn.Softmax):
+            setattr(network, head_name, head[:-1])
+    return network
+
+
+def compile_network(network):
+    """
+    Compiled view of network for the many small forwards made in training.
+    It shares parameters with network, so optimizer steps and load_state_dict
+    apply to both. CUDA graphs only pay off on the GPU, so the eager module is
+    returned as is on the CPU, and on CUDA unless COMPILE_NETWORK is set.
+    The batch size is traced as dynamic: vote batches hold only the rows that
+    do not explore, a random count, and static shapes would recompile for each
+    new count until dynamo's recompile limit sends calls back to eager.
+    """
+    if device.type == 'cuda' and COMPILE_NETWORK:
+        return torch.compile(network, mode='reduce-overhead', dynamic=True)
+    return network
+
+
+def inference_network(network):
+    """
+    View of network for forwards that never need gradients, like the target
+    network's. On the CPU it is a copy with int8 dynamically quantized linear
+    layers, so it has to be rebuilt whenever network's weights change.
+    """
+    if device.type == 'cuda':
+        return compile_network(network)
+    return torch.ao.quantization.quantize_dynamic(network, {nn.Linear}, dtype=torch.qint8)
+
+
 class NeuralNetworkCitizenPolicy(Policy):
     policy_name = "NeuralNetworkCitizenPolicy"
 
@@ -76,17 +127,27 @@ class NeuralNetworkCitizenPolicy(Policy):
         self.num_players = num_players
         try:
             logger.info("Loading model...")
-            self.network = torch.load(MODEL_PATH).to(device)
-            self.target_net = torch.load(MODEL_PATH).to(device)
+            self.network = drop_output_softmax(torch.load(MODEL_PATH)).to(device)
         except Exception:
             logger.error("Error in loading model")
             self.network = MultiHeadNetwork(INPUT_LAYER_SIZE, INPUT_LAYER_SIZE, num_players).to(device)
-            self.target_net = MultiHeadNetwork(INPUT_LAYER_SIZE, INPUT_LAYER_SIZE, num_players).to(device)
-
-        self.optimizer = optim.Adam(self.network.parameters(), lr=0.00025)
+        # The target starts as an in-memory copy instead of a second load
+        self.target_net = copy.deepcopy(self.network)
+        # Forwards go through these, self.network and self.target_net stay
+        # plain modules for saving and state dict copies
+        self.network_forward = compile_network(self.network)
+        self.target_forward = inference_network(self.target_net)
+
+        # One fused kernel per step on CUDA, multi-tensor ops elsewhere
+        fused = device.type == 'cuda'
+        self.optimizer = optim.Adam(
+            self.network.parameters(), lr=0.00025, fused=fused, foreach=not fused
+        )
         self.criterion = nn.MSELoss()
         self.epsilon = 1
         self.epsilon_decay = 0.995
+        # Exploration draws, made in batches where the caller has several rows
+        self.rng = np.random.default_rng()
 
     def get_output_size(self, action_type):
         output_size = {"make_declarations": self.num_players * 3 * 2 + 1,
@@ -95,37 +156,44 @@ class NeuralNetworkCitizenPolicy(Policy):
         return output_size[action_type]
 
     def get_action_vector(self, state_vector, action_type):
-        if random.random() < self.epsilon:
+        if self.rng.random() < self.epsilon:
             # Generate a random action vector
             action_vector = torch.rand(self.get_output_size(action_type))
         else:
             # Use the network to generate the action vector
             with torch.no_grad():
-                declaration_vector, voting_vector, nominating_vector = self.network(state_vector.unsqueeze(0))
-                if action_type == 'nominate_player':
-                    action_vector = nominating_vector
-                elif action_type == 'vote':
-                    action_vector = voting_vector
-                elif action_type == 'make_declarations':
-                    action_vector = declaration_vector
+                action_vector = self.network_forward(
+                    state_vector.unsqueeze(0).to(device, non_blocking=True),
+                    action_type,
+                ).cpu()
 
         return action_vector.squeeze(0)
 
+    def get_action_vectors(self, state_vectors, action_type):
+        """
+        Batched get_action_vector: one row per state vector, with a single
+        forward pass for all rows that are not exploring
+        """
+        explore = torch.from_numpy(self.rng.random(len(state_vectors)) < self.epsilon)
+        action_vectors = torch.rand(len(state_vectors), self.get_output_size(action_type))
+        if not explore.all():
+            with torch.no_grad():
+                action_vectors[~explore] = self.network_forward(
+                    state_vectors[~explore].to(device, non_blocking=True),
+                    action_type,
+                ).cpu()
+        return action_vectors
+
     def _get_declarations_from_vector(self, action_vector, game_state):
         # The action vector should already be masked, so we just need to find the indices of the maximum values.
         # These indices correspond to the declarations that the agent has decided to make.
         top_indices = torch.topk(action_vector, 3).indices  # Get the indices of the top 3 values
-        declarations = []
-        for index in top_indices:
-            if index < 60:
-                target = game_state.players[index % 10]
-                belief = index % 20 // 10
-                if belief == 0:
-                    belief = Role.MAFIA
-                else:
-                    belief = Role.CITIZEN
-
-                declarations.append((target, belief))
+        # A single sync for all three, the decoding below is plain Python
+        declarations = [
+            (game_state.players[DECLARATION_TABLE[index][0]], DECLARATION_TABLE[index][1])
+            for index in top_indices.tolist()
+            if index < 60
+        ]
 
         return declarations, top_indices
 
@@ -136,7 +204,7 @@ class NeuralNetworkCitizenPolicy(Policy):
         vote_index = torch.argmax(action_vector).item()
         voted_player = game_state.players[vote_index]
 
-        return voted_player, torch.Tensor([vote_index])
+        return voted_player, vote_index
 
     def _get_kill_from_vector(self, action_vector):
         # TODO: Implement this method to convert the output vector of the network into a kill
@@ -151,35 +219,43 @@ class NeuralNetworkCitizenPolicy(Policy):
         else:
             nominated_player = None  # The agent has decided not to nominate anyone
 
-        return nominated_player, torch.Tensor([nomination_index])
+        return nominated_player, nomination_index
 
     def get_vector(self, game_state, action_type, player):
-        state_vector = game_state.get_state_vector(player, action_type)
-        action_vector = self.get_action_vector(state_vector, action_type)
-        player.action_vector = action_vector
+        prefetched = player.prefetched_actions.pop(action_type, None)
+        if prefetched is None:
+            state_vector = game_state.get_state_vector(player, action_type)
+            action_vector = self.get_action_vector(state_vector, action_type)
+        else:
+            action_vector = prefetched[0]
+        # One-hot of the chosen actions, set by the caller once it decides
+        player.action_vector = player.action_buffer(action_type, action_vector.numel())
         return action_vector
 
     def make_declarations(self, game_state, player):
         action_type = "make_declarations"
         action_vector = self.get_vector(game_state, action_type, player)
         declarations, action_vector_indices = self._get_declarations_from_vector(action_vector, game_state)
-        player.action_vector.index_fill_(0, action_vector_indices.long(), 1)
+        player.action_vector.index_fill_(0, action_vector_indices, 1)
         return declarations
 
     def vote(self, game_state, player):
         action_type = "vote"
         action_vector = self.get_vector(game_state, action_type, player)
 
-        mask = torch.zeros(10, dtype=torch.bool)
-        for player in game_state.nominated_players:
-            mask[player.id] = True  # Only nominated players are considered
-
-        action_vector = action_vector.masked_fill(~mask, -1e9)
+        # Only nominated players are considered. The logits are this call's
+        # own copy, so they are masked in place before the argmax; the
+        # not-nominated mask is the game's reused buffer, not a new array
+        not_nominated = torch.as_tensor(
+            game_state.mask_array(game_state.nominated_mask, invert=True),
+            device=action_vector.device,
+        )
+        action_vector.masked_fill_(not_nominated, float('-inf'))
 
-        target_player, action_vector_indices = self._get_vote_from_vector(action_vector, game_state)
+        target_player, action_vector_index = self._get_vote_from_vector(action_vector, game_state)
         if not target_player:
             return
-        player.action_vector.index_fill_(0, action_vector_indices.long(), 1)
+        player.action_vector[action_vector_index] = 1
         return target_player
 
     def kill(self, game_state, player):
@@ -192,6 +268,6 @@ class NeuralNetworkCitizenPolicy(Policy):
     def nominate_player(self, game_state, player):
         action_type = "nominate_player"
         action_vector = self.get_vector(game_state, action_type, player)
-        target_player, action_vector_indices = self._get_nomination_from_vector(action_vector, game_state)
-        player.action_vector.index_fill_(0, action_vector_indices.long(), 1)
+        target_player, action_vector_index = self._get_nomination_from_vector(action_vector, game_state)
+        player.action_vector[action_vector_index] = 1
         return target_player
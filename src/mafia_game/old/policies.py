@@ -1,13 +1,13 @@
 import random
 import pytest
-from mafia_game.models import Role, Policy
+from mafia_game.old.models import ROLES, Role, Policy
 
 
 def random_citizen_declarations(game_state, player):
     declarations = []
     for _ in range(random.randint(0, 3)):
         target = random.choice(game_state.players)
-        belief = random.choice(list(Role))
+        belief = random.choice(ROLES)
         declarations.append((target, belief))
     return declarations
 
@@ -19,10 +19,8 @@ def random_citizen_kill(game_state, player):
 def random_mafia_declarations(game_state, player):
     declarations = []
     for _ in range(random.randint(0, 3)):
-        target = random.choice(
-            [p for p in game_state.players if p.role == Role.CITIZEN]
-        )
-        belief = random.choice(list(Role))
+        target = random.choice(game_state.citizens)
+        belief = random.choice(ROLES)
         declarations.append((target, belief))
     return declarations
 
@@ -40,13 +38,14 @@ def mafia_vote(game_state, player):
 
 
 def random_nominate(game_state, player):
-    return random.choice([player for player in game_state.players if player.is_alive] + [None] * 3)
+    # Any alive player, or nobody with the weight of three players
+    alive_players = game_state.alive_players
+    index = random.randrange(len(alive_players) + 3)
+    return alive_players[index] if index < len(alive_players) else None
 
 
 def random_mafia_kill(game_state, player):
-    alive_citizens = [
-        p for p in game_state.players if p.is_alive and p.role == Role.CITIZEN
-    ]
+    alive_citizens = game_state.alive_citizens
     return random.choice(alive_citizens) if alive_citizens else None
 
 
@@ -1,15 +1,14 @@
 # Define the environment
-import json
 import logging
 import os
-from collections import deque
 
+import numpy as np
 import torch
 
 from mafia_game.logger import logger
-from mafia_game.models import Role, Player, GameState, GameController, Team
-from mafia_game.nn_policy import NeuralNetworkCitizenPolicy, MODEL_PATH
-from mafia_game.policies import StaticMafiaPolicy
+from mafia_game.old.models import Role, Player, GameState, BatchedGameController, Team
+from mafia_game.old.nn_policy import NeuralNetworkCitizenPolicy, MODEL_PATH, device, inference_network
+from mafia_game.old.policies import StaticMafiaPolicy
 import torch.nn.functional as F
 import random
 
@@ -25,48 +24,214 @@ class MafiaEnvironment():
         self.mafia_won = 0
         self.citizens_won = 0
 
-    def reset(self):
+    def new_game_state(self):
         players = [Player(i, Role.CITIZEN, self.citizen_policy) for i in range(7)]
         players[0].learner = True
         players += [Player(i, Role.MAFIA, self.mafia_policy) for i in range(7, 10)]
         random.shuffle(players)
         for i, player in enumerate(players, 0):
             player.id = i
-        game_state = GameState(players)
-        self.game_controller = GameController(game_state, agent)
-
-    def play(self, n_rounds=1) -> Role:
-        for i in range(n_rounds):
-            self.reset()
-            winner = self.game_controller.start_game()
-            if winner == Role.MAFIA:
-                self.mafia_won += 1
-            else:
-                self.citizens_won += 1
+        return GameState(players)
+
+    def play(self, n_rounds=1, parallel_games=1) -> Role:
+        # Games are played parallel_games at a time in lockstep, so the
+        # network scores their votes in one batch
+        for start in range(0, n_rounds, parallel_games):
+            game_states = [
+                self.new_game_state()
+                for _ in range(min(parallel_games, n_rounds - start))
+            ]
+            self.game_controller = BatchedGameController(game_states, self.agent)
+            for winner in self.game_controller.start_games():
+                if winner == Role.MAFIA:
+                    self.mafia_won += 1
+                else:
+                    self.citizens_won += 1
 
         print(f"Mafia won: {self.mafia_won}, Citizens won: {self.citizens_won}")
         print(f"Citizens winrate: {self.citizens_won / n_rounds}")
 
 
+class ReplayMemory:
+    """
+    Ring buffer of transitions kept as one preallocated tensor per field,
+    so a batch is sampled with a single index op instead of stacking tuples
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.ptr = 0
+        self.size = 0
+        self.states = None
+
+    def __len__(self):
+        return self.size
+
+    def _allocate(self, state, action, reward):
+        # States keep their compact dtype, the network casts them on input
+        shape = (self.capacity, state.numel())
+        self.states = torch.empty(shape, dtype=state.dtype, device=device)
+        self.next_states = torch.empty(shape, dtype=state.dtype, device=device)
+        self.actions = torch.empty((self.capacity, action.numel()), device=device)
+        # Rewards are scalars, stored flat so batches need no squeeze
+        self.rewards = torch.empty(self.capacity, device=device)
+
+    def push(self, state, action, next_state, reward):
+        if self.states is None:
+            self._allocate(state, action, reward)
+        self.states[self.ptr] = state
+        self.actions[self.ptr] = action
+        self.next_states[self.ptr] = next_state
+        self.rewards[self.ptr] = reward
+        self.ptr = (self.ptr + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        idx = torch.randint(0, self.size, (batch_size,), device=device)
+        return self.states[idx], self.actions[idx], self.next_states[idx], self.rewards[idx]
+
+
+class MemmapReplayMemory(ReplayMemory):
+    """
+    ReplayMemory kept in memory-mapped .npy files under path instead of on
+    the device. The buffer survives restarts, and sampled batches are copied
+    to the device asynchronously from pinned memory
+    """
+
+    FIELDS = ('states', 'actions', 'next_states', 'rewards')
+
+    def __init__(self, path, capacity=10000):
+        super().__init__(capacity)
+        self.path = path
+        self.rng = np.random.default_rng()
+        # Set while resumed files still have to be checked against the
+        # first pushed transition
+        self.resumed = False
+        if os.path.exists(self._file('meta')):
+            # Resume the buffer left by a previous run
+            self._open('r+')
+            self._check_stored_shapes()
+            self.resumed = True
+
+    def _file(self, field):
+        return f'{self.path}.{field}.npy'
+
+    def _open(self, mode, shapes=None):
+        for field in self.FIELDS:
+            dtype, shape = shapes[field] if shapes else (None, None)
+            setattr(self, field, np.lib.format.open_memmap(
+                self._file(field), mode=mode, dtype=dtype, shape=shape
+            ))
+        # Write position and fill level, stored with the data
+        self.meta = np.lib.format.open_memmap(
+            self._file('meta'), mode=mode, dtype=np.int64, shape=(2,) if shapes else None
+        )
+        self.ptr, self.size = self.meta.tolist()
+
+    def _layout_error(self, field, found, expected):
+        return ValueError(
+            f'{self._file(field)} holds {found}, expected {expected}; '
+            f'delete the {self.path}.*.npy files to start a new replay memory'
+        )
+
+    def _check_stored_shapes(self):
+        for field in self.FIELDS:
+            rows = getattr(self, field).shape[0]
+            if rows != self.capacity:
+                raise self._layout_error(
+                    field, f'{rows} transitions', f'capacity {self.capacity}'
+                )
+        # Files from before rewards were stored flat have shape (capacity, 1),
+        # which would broadcast into a (batch, batch) target
+        if self.rewards.shape != (self.capacity,):
+            raise self._layout_error(
+                'rewards', f'shape {self.rewards.shape}', f'shape {(self.capacity,)}'
+            )
+
+    def _check_transition(self, state, action):
+        stored = {
+            'states': (state.numpy().dtype, state.numel()),
+            'next_states': (state.numpy().dtype, state.numel()),
+            'actions': (np.dtype(np.float32), action.numel()),
+        }
+        for field, (dtype, width) in stored.items():
+            array = getattr(self, field)
+            if array.dtype != dtype or array.shape[1:] != (width,):
+                raise self._layout_error(
+                    field,
+                    f'{array.dtype} rows of shape {array.shape[1:]}',
+                    f'{dtype} rows of shape {(width,)}',
+                )
+
+    def _allocate(self, state, action, reward):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        shape = (self.capacity, state.numel())
+        self._open('w+', {
+            'states': (state.numpy().dtype, shape),
+            'next_states': (state.numpy().dtype, shape),
+            'actions': (np.float32, (self.capacity, action.numel())),
+            'rewards': (np.float32, (self.capacity,)),
+        })
+
+    def push(self, state, action, next_state, reward):
+        if self.resumed:
+            self._check_transition(state, action)
+            self.resumed = False
+        super().push(state, action, next_state, reward)
+        self.meta[:] = self.ptr, self.size
+
+    def _to_device(self, array):
+        tensor = torch.from_numpy(array)
+        if device.type == 'cuda':
+            tensor = tensor.pin_memory()
+        return tensor.to(device, non_blocking=True)
+
+    def sample(self, batch_size):
+        idx = self.rng.integers(0, self.size, batch_size)
+        return tuple(self._to_device(getattr(self, field)[idx]) for field in self.FIELDS)
+
+
 class DQNAgent:
-    def __init__(self, policy):
+    def __init__(self, policy, update_every=4, memory_path=None):
         self.policy = policy
-        self.memory = {'nominate_player': deque(maxlen=10000),
-                       'vote': deque(maxlen=10000),
-                       'make_declarations': deque(maxlen=10000)}
+        # Gradient steps are taken every update_every transitions (and at the
+        # end of every episode) rather than on each one
+        self.update_every = update_every
+        # With memory_path the replay memories are memory-mapped files there
+        # rather than device tensors
+        self.memory = {
+            action_type: (
+                MemmapReplayMemory(f'{memory_path}/{action_type}', 10000)
+                if memory_path else ReplayMemory(10000)
+            )
+            for action_type in ('nominate_player', 'vote', 'make_declarations')
+        }
         self.gamma = 0.97  # discount factor
         self.steps = 0
         self.episode = 0
+        # Kept open for the whole run, flushed whenever the model is saved
+        self.progress_log = open(log_file, 'a', buffering=1 << 20)
+        # Matching parameter lists of the two networks, for syncing the target
+        self.network_params = list(policy.network.parameters())
+        self.target_params = list(policy.target_net.parameters())
 
     def select_action(self, state):
         # TODO: Implement epsilon-greedy action selection here
         pass
 
     def store_experience(self, state, action, next_state, reward, action_type):
-        self.memory[action_type].append([state, action, next_state, reward])
+        self.memory[action_type].push(state, action, next_state, reward)
 
     def update_target_net(self):
-        self.policy.target_net.load_state_dict(self.policy.network.state_dict())
+        # Copied in place, without a state dict round trip; the networks
+        # have no buffers, so their parameters are the whole state
+        with torch.no_grad():
+            for target_param, param in zip(self.target_params, self.network_params):
+                target_param.copy_(param)
+        # On CUDA target_forward runs target_net, compiled or not, and sees
+        # the new weights; the CPU quantized copy has to be rebuilt
+        if device.type != 'cuda':
+            self.policy.target_forward = inference_network(self.policy.target_net)
 
     def update_policy(self, batch_size, action_type, episode_done, total_reward):
         self.steps += 1
@@ -77,17 +242,20 @@ class DQNAgent:
             logger.info(f"Saving model, updating target model. Total steps: {self.steps}")
             logger.setLevel(logging.ERROR)
             torch.save(self.policy.network, MODEL_PATH)
+            self.progress_log.flush()
 
         if len(self.memory[action_type]) < batch_size:
             return
-        batch_state, batch_action, batch_next_state, batch_reward = zip(*random.sample(self.memory[action_type], batch_size))
+        if not episode_done and self.steps % self.update_every:
+            return
+        batch_state, batch_action, batch_next_state, batch_reward = self.memory[action_type].sample(batch_size)
 
         """
         Shapes are:
         
         batch_state: torch.Size([32, 3034])
         batch_action: torch.Size([32, 94])
-        batch_reward: torch.Size([32, 1])
+        batch_reward: torch.Size([32])
         batch_next_state: torch.Size([32, 3034])
         
         state_action_values: torch.Size([32, 21])
@@ -95,22 +263,14 @@ class DQNAgent:
         expected_state_action_values: torch.Size([32, 32])
         """
 
-        batch_state = torch.stack(batch_state)
-        batch_action = torch.stack(batch_action).long()
-        batch_reward = torch.stack(batch_reward)
-        batch_next_state = torch.stack(batch_next_state)
+        batch_action = batch_action.long()
 
         # Compute Q(s_t, a) - the model computes Q(s_t), then we select the
         # columns of actions taken. These are the actions which would've been taken
         # for each batch state according to policy_net
 
-        declaration_out, voting_out, nominating_out = self.policy.network(batch_state)
-
-        actions = {'make_declarations': declaration_out,
-                   'vote': voting_out,
-                   'nominate_player': nominating_out}
-
-        state_action_values = (actions[action_type] * batch_action).sum(dim=1)
+        q_values = torch.softmax(self.policy.network_forward(batch_state, action_type), dim=1)
+        state_action_values = (q_values * batch_action).sum(dim=1)
 
         # Compute V(s_{t+1}) for all next states.
         # Expected values of actions for non_final_next_states are computed based
@@ -118,14 +278,14 @@ class DQNAgent:
         # This is merged based on the mask, such that we'll have either the expected
         # state value or 0 in case the state was final.
 
-        declaration_out, voting_out, nominating_out = self.policy.target_net(batch_next_state)
-        actions = {'make_declarations': declaration_out,
-                   'vote': voting_out,
-                   'nominate_player': nominating_out}
-
-        next_state_values = actions[action_type].max(1)[0].detach()
-        # Compute the expected Q values
-        expected_state_action_values = (next_state_values * self.gamma) + batch_reward.squeeze()
+        with torch.no_grad():
+            next_q_values = torch.softmax(
+                self.policy.target_forward(batch_next_state, action_type), dim=1
+            )
+        next_state_values = next_q_values.max(1)[0]
+        # Compute the expected Q values, rewards + gamma * next_state_values
+        # as a single kernel
+        expected_state_action_values = batch_reward.add(next_state_values, alpha=self.gamma)
 
         # Compute Huber loss
         loss = self.policy.criterion(state_action_values, expected_state_action_values)
@@ -133,9 +293,7 @@ class DQNAgent:
         # Optimize the model
         self.policy.optimizer.zero_grad()
         loss.backward()
-        for param in self.policy.network.parameters():
-            if param.grad is not None:
-                param.grad.data.clamp_(-1, 1)
+        torch.nn.utils.clip_grad_value_(self.policy.network.parameters(), 1)
         self.policy.optimizer.step()
 
         if episode_done:
@@ -144,19 +302,17 @@ class DQNAgent:
                 self.policy.epsilon = 0.05
 
             self.episode += 1
-            with open(log_file, 'a') as f:
-                json.dump({
-                    'loss': loss.item(),
-                    'reward': total_reward,
-                    'epsilon': self.policy.epsilon
-                }, f)
-                f.write('\n')
+            self.progress_log.write(
+                f'{{"loss": {loss.item()}, "reward": {total_reward}, '
+                f'"epsilon": {self.policy.epsilon}}}\n'
+            )
 
 
-# Define the agent
+if __name__ == "__main__":
+    # Define the agent
 
-policy = NeuralNetworkCitizenPolicy(num_players=10)
-agent = DQNAgent(policy)
-env = MafiaEnvironment(policy, agent)
+    policy = NeuralNetworkCitizenPolicy(num_players=10)
+    agent = DQNAgent(policy, memory_path=f'{os.path.dirname(MODEL_PATH)}/replay_memory')
+    env = MafiaEnvironment(policy, agent)
 
-env.play(500000)
+    env.play(500000, parallel_games=16)
@@ -1,10 +1,12 @@
+import os
 import random
+import time
 
 import numpy as np
 import torch
 
 from mafia_game.actions import InputTypes
-from mafia_game.common import Role, Team
+from mafia_game.common import BLACK_ROLES, STATE_DTYPE, Role, Team
 from mafia_game.game_state import (
     CompleteGameState,
     DayPhase,
@@ -14,31 +16,66 @@ from mafia_game.game_state import (
 from mafia_game.logger import logger
 from mafia_game.multihead_nn import select_action
 
-from collections import deque
-import random
+# Roles dealt at the start of every game, one per seat
+ROLE_DEAL = (Role.CITIZEN,) * 6 + (Role.SHERIFF,) + (Role.MAFIA,) * 2 + (Role.DON,)
 
 
 class ReplayBuffer:
+    # Ring buffer over a preallocated list: unlike a deque, indexing any slot
+    # is O(1), so sampling never walks the buffer
     def __init__(self, capacity):
-        self.buffer = deque(maxlen=capacity)
+        self.capacity = capacity
+        self.buffer = [None] * capacity
+        self.position = 0
+        self.size = 0
 
-    def push(self, state, action, reward, done, next_state):
-        self.buffer.append((state, action, reward, done, next_state))
+    def push(
+        self, state, action, reward, done, next_state, is_black, mask, next_mask
+    ):
+        # The acting player's team and both action masks are stored with the
+        # transition, so updates never have to deserialize the states.
+        # Serialized states only hold small integers (player indexes, roles,
+        # turns), so they are kept as int8 and cast when batched
+        self.buffer[self.position] = (
+            np.asarray(state, dtype=np.int8),
+            action,
+            reward,
+            done,
+            np.asarray(next_state, dtype=np.int8),
+            is_black,
+            mask,
+            next_mask,
+        )
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
 
     def sample(self, batch_size):
-        return random.sample(self.buffer, batch_size)
+        return [self.buffer[i] for i in random.sample(range(self.size), batch_size)]
 
     def __len__(self):
-        return len(self.buffer)
+        return self.size
 
 
 def update_q_values(
-    red_network, black_network, optimizer, loss_function, experiences, gamma=0.99
+    red_network,
+    black_network,
+    optimizer,
+    loss_function,
+    experiences,
+    gamma=0.99,
+    loss_log=None,
 ):
     # Unpack experiences
-    serialized_states, action_data_tuples, rewards, dones, serialized_next_states = zip(
-        *experiences
-    )
+    (
+        serialized_states,
+        action_data_tuples,
+        rewards,
+        dones,
+        serialized_next_states,
+        is_black,
+        current_masks,
+        next_masks,
+    ) = zip(*experiences)
 
     # Convert serialized states to tensors
     states = torch.tensor(np.array(serialized_states), dtype=torch.float32)
@@ -46,80 +83,65 @@ def update_q_values(
     next_states = torch.tensor(np.array(serialized_next_states), dtype=torch.float32)
     dones = torch.tensor(dones, dtype=torch.float32)
 
-    # Initialize lists to store current and target Q-values
+    # Group the batch by network and action type, so every group is scored
+    # with one batched forward instead of one forward per experience
+    groups = {}
+    for i, (action_type, _) in enumerate(action_data_tuples):
+        network = black_network if is_black[i] else red_network
+        groups.setdefault((network, action_type), []).append(i)
+
     current_q_values_list = []
     target_q_values_list = []
     loss_list = []
 
-    # Loop through each experience
-    for state, action_data_tuple, reward, next_state, done in zip(
-        states, action_data_tuples, rewards, next_states, dones
-    ):
-        action_type, action_data = action_data_tuple
-        deserialized_state = CompleteGameState.deserialize(state.numpy())
-        player_index = deserialized_state.active_player
-        deserialized_next_state = CompleteGameState.deserialize(next_state.numpy())
-        player_state = deserialized_state.game_states[player_index]
-
-        if player_state.private_data.role in (Role.MAFIA, Role.DON):
-            network = black_network
-        else:
-            network = red_network
-
+    for (network, action_type), indices in groups.items():
         action_type_index = network.action_types.index(action_type)
+        idx = torch.tensor(indices)
+        action_data = [action_data_tuples[i][1] for i in indices]
 
-        mask1 = action_type.generate_action_mask(deserialized_state, player_index)
-        mask2 = action_type.generate_action_mask(deserialized_next_state, player_index)
-        # Get outputs for all actions using training mode
-        current_outputs = network(deserialized_state, action_type_index, mask1)
-        next_outputs = network(deserialized_next_state, action_type_index, mask2)
+        current_outputs = network(
+            states[idx],
+            action_type_index,
+            torch.stack([current_masks[i] for i in indices]),
+        )
 
-        # Select the Q-value for the action taken
         if action_type.input_type == InputTypes.INDEX:
-            action_data_tensor = torch.tensor([action_data], dtype=torch.int64)
-            current_q_values = current_outputs.gather(
-                1, action_data_tensor.unsqueeze(1)
+            # Targets are constants for the update, no graph is needed
+            with torch.no_grad():
+                next_outputs = network(
+                    next_states[idx],
+                    action_type_index,
+                    torch.stack([next_masks[i] for i in indices]),
+                )
+            # Select the Q-value for the action taken
+            action_data_tensor = torch.tensor(action_data, dtype=torch.int64)
+            current_q_values_list.append(
+                current_outputs.gather(1, action_data_tensor.unsqueeze(1)).squeeze(1)
+            )
+            # Bellman target, or just the reward for the last move of a game
+            max_next_q_values = next_outputs.max(1)[0]
+            target_q_values_list.append(
+                torch.where(
+                    dones[idx].bool(),
+                    rewards[idx],
+                    rewards[idx] + gamma * max_next_q_values,
+                )
             )
-            current_q_values_list.append(current_q_values)
         elif action_type.input_type == InputTypes.VECTOR:
-            # For VECTOR input type, the action_data is the entire belief vector
-            # Reshape current_outputs to match the shape expected by the normalize_vector function
-            reshaped_current_outputs = current_outputs.view(-1, 10, 3)
-            # Normalize the output to represent a probability distribution for each player
+            # For VECTOR input type, the action_data is the belief vector:
+            # one team index per player, compared with the softmaxed output
             current_beliefs = torch.nn.functional.softmax(
-                reshaped_current_outputs, dim=2
+                current_outputs.view(-1, 10, 3), dim=2
             )
-            # Assuming action_data is the target belief vector
-            # Convert action_data to a tensor and reshape it to match the current_beliefs shape
             target_beliefs = torch.tensor(action_data, dtype=torch.int64).view(-1, 10)
-            # Calculate the cross-entropy loss for each belief vector
-            # Cross-entropy loss expects a long tensor of class indices for the target
             belief_loss = torch.nn.functional.cross_entropy(
                 current_beliefs.view(-1, 3), target_beliefs.view(-1), reduction="none"
             )
-            # Reshape belief_loss back to the batch shape and store for later aggregation
-            belief_loss = belief_loss.view(-1, 10).mean(
-                dim=1
-            )  # Take the mean loss across all players
-            loss_list.append(belief_loss)
-
-        # Compute the target Q-value for INDEX type actions
-        if action_type.input_type == InputTypes.INDEX:
-            if done:
-                target_q_values = reward
-            else:
-                # Get the maximum Q-value for the next state
-                max_next_q_values = next_outputs.max(1)[0]
-                # Compute the target Q-value using the Bellman equation
-                target_q_values = reward + (gamma * max_next_q_values)
-
-            target_q_values_list.append(target_q_values)
-            # Store the current and target Q-values
+            # Take the mean loss across all players of each experience
+            loss_list.append(belief_loss.view(-1, 10).mean(dim=1))
 
     current_q_values = (
-        torch.cat(current_q_values_list).squeeze(1)
-        if current_q_values_list
-        else torch.tensor([])
+        torch.cat(current_q_values_list) if current_q_values_list else torch.tensor([])
     )
     all_losses = torch.cat(loss_list) if loss_list else torch.tensor([])
     # Compute the loss for INDEX type actions
@@ -142,15 +164,28 @@ def update_q_values(
 
     resulting_loss = total_loss.item()
 
-    with open(
-        "/home/ANT.AMAZON.COM/zedmor/PycharmProjects/mafia_modeling/src/mafia_game/logs/loss_file.log",
-        "a",
-    ) as loss_file:
-        loss_file.write(f"LOSS: {resulting_loss}\n")
+    # The caller owns the file, so it is opened once per run, not per update
+    if loss_log is not None:
+        loss_log.write(f"LOSS: {resulting_loss}\n")
 
     return resulting_loss
 
 
+def push_pending_transition(replay_buffer, pending, game, is_black):
+    # Completes a pending transition with the state the game is in now
+    state, (action_type, action_data), reward, done, player_index, mask = pending
+    replay_buffer.push(
+        state,
+        (action_type, action_data),
+        reward,
+        done,
+        game.serialize(),
+        is_black,
+        mask,
+        action_type.generate_action_mask(game, player_index),
+    )
+
+
 def train(
     red_network,
     black_network,
@@ -161,25 +196,26 @@ def train(
     gamma=0.99,
     replay_buffer_size=10000,
     batch_size=64,
+    loss_log=None,
 ):
     replay_buffer = ReplayBuffer(replay_buffer_size)
+    # Own generator per process, so parallel workers neither share
+    # nor contend on the global random state
+    rng = random.Random(os.getpid() ^ time.time_ns())
 
     for episode in range(num_episodes):
-        game_states = [
-            create_game_state_with_role(r)
-            for r in [Role.CITIZEN] * 6 + [Role.SHERIFF] + [Role.MAFIA] * 2 + [Role.DON]
-        ]
-        random.shuffle(game_states)
+        # Seat the roles in random order; the black seats are read off the
+        # dealt roles, before any GameState is built
+        roles = rng.sample(ROLE_DEAL, len(ROLE_DEAL))
+        game_states = [create_game_state_with_role(role) for role in roles]
 
         mafia_player_indexes = [
-            i
-            for i in range(10)
-            if game_states[i].private_data.role in (Role.MAFIA, Role.DON)
+            i for i, role in enumerate(roles) if role in BLACK_ROLES
         ]
 
         for mafia_player in mafia_player_indexes:
             game_states[mafia_player].private_data.other_mafias.other_mafias = np.array(
-                mafia_player_indexes
+                mafia_player_indexes, dtype=STATE_DTYPE
             )
 
         game = CompleteGameState(
@@ -226,10 +262,14 @@ def train(
                 if player_state.alive:
                     for action_type in allowed_actions:
                         action, action_data = select_action(
-                            network, game, action_type, game.active_player
+                            network, game, action_type, game.active_player, rng=rng
                         )
                         if action:
-                            old_state = game.deserialize(game.serialize())
+                            # serialize() already returns a fresh array, which is
+                            # all the replay buffer needs from the pre-action state
+                            old_state = game.serialize()
+                            player_index = game.active_player
+                            mask = action_type.generate_action_mask(game, player_index)
                             logger.info(action)
                             game.execute_action(action)
                             game.check_end_conditions()
@@ -238,28 +278,36 @@ def train(
                             if is_red_player:
                                 if not red_states:
                                     red_states = [
-                                        old_state.serialize(),
+                                        old_state,
                                         (action_type, action_data),
                                         reward,
                                         int(game.team_won != Team.UNKNOWN),
+                                        player_index,
+                                        mask,
                                     ]
                                 else:
                                     # Use current reward as well
-                                    red_states[-2] = red_states[-2] + reward * 0.99
-                                    replay_buffer.push(*red_states, game.serialize())
+                                    red_states[2] = red_states[2] + reward * 0.99
+                                    push_pending_transition(
+                                        replay_buffer, red_states, game, False
+                                    )
                                     red_states = []
 
                             if is_black_player:
                                 if not black_states:
                                     black_states = [
-                                        old_state.serialize(),
+                                        old_state,
                                         (action_type, action_data),
                                         reward,
                                         int(game.team_won != Team.UNKNOWN),
+                                        player_index,
+                                        mask,
                                     ]
                                 else:
-                                    black_states[-2] = black_states[-2] + reward * 0.99
-                                    replay_buffer.push(*black_states, game.serialize())
+                                    black_states[2] = black_states[2] + reward * 0.99
+                                    push_pending_transition(
+                                        replay_buffer, black_states, game, True
+                                    )
                                     black_states = []
 
                             if len(replay_buffer) > batch_size:
@@ -271,14 +319,11 @@ def train(
                                     loss_function,
                                     experiences,
                                     gamma,
+                                    loss_log,
                                 )
                 game.check_end_conditions()
-                while True and game.team_won == Team.UNKNOWN:
-                    game.active_player += 1
-                    if game.active_player > 9:
-                        game.active_player = 0
-                    if game.game_states[game.active_player].alive:
-                        break
+                if game.team_won == Team.UNKNOWN:
+                    game.active_player = game.next_alive_player(game.active_player)
 
                 if (
                     game.active_player == started_player
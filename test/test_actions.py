@@ -243,3 +243,23 @@ def test_public_sheriff_declaration_action_from_index_negative(mock_game_state):
         expected_team = Team.BLACK_TEAM if valid_action_index % 2 == 0 else Team.RED_TEAM
         assert action.target_player == expected_target_player
         assert action.role == expected_team
+
+
+@pytest.mark.parametrize("action_class", [KillAction, NominationAction])
+def test_target_action_mask_excludes_dead_and_self(action_class):
+    game_state = create_test_game_state()
+    game_state.game_states[4].alive = 0
+    mask = action_class.generate_action_mask(game_state, player_index=2)
+    expected = torch.ones(MAX_PLAYERS)
+    expected[[2, 4]] = 0
+    assert mask.dtype == torch.float32
+    assert torch.equal(mask, expected)
+
+
+def test_vote_action_mask_allows_only_nominated():
+    game_state = create_test_game_state()
+    assert not VoteAction.generate_action_mask(game_state, player_index=0).any()
+    game_state.nominated_players = [3, 7]
+    mask = VoteAction.generate_action_mask(game_state, player_index=0)
+    assert mask.dtype == torch.float32
+    assert torch.nonzero(mask).flatten().tolist() == [3, 7]
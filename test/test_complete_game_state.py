@@ -41,6 +41,37 @@ def test_complete_game_state_serialization():
     assert reconstructed_object.team_won == Team.RED_TEAM
 
 
+def test_complete_game_state_serializes_to_int8():
+    complete_game_state = CompleteGameState(
+        game_states=[create_dummy_game_state(Role.MAFIA) for _ in range(MAX_PLAYERS)],
+        active_player=9,
+        turn=3,
+    )
+    serialized_state = complete_game_state.serialize()
+    assert serialized_state.dtype == np.int8
+
+    reconstructed_object = CompleteGameState.deserialize(serialized_state)
+    assert reconstructed_object.active_player == 9
+    assert reconstructed_object.game_states[0].private_data.role == Role.MAFIA
+    assert np.array_equal(reconstructed_object.serialize(), serialized_state)
+
+
+def test_complete_game_state_serialize_matches_per_player_layout():
+    complete_game_state = CompleteGameState(
+        game_states=[create_dummy_game_state(Role.SHERIFF) for _ in range(MAX_PLAYERS)],
+        active_player=4,
+        turn=2,
+    )
+    complete_game_state.game_states[1].public_data.votes.checks[2][6] = 1
+    complete_game_state.game_states[8].alive = 0
+
+    expected = np.concatenate(
+        [state.serialize() for state in complete_game_state.game_states]
+        + [np.array([4, DayPhase.value, 2, Team.UNKNOWN.value])]
+    )
+    assert np.array_equal(complete_game_state.serialize(), expected)
+
+
 # Test deserialization of CompleteGameState
 def test_complete_game_state_deserialization():
     # Create a serialized state with dummy data
@@ -181,3 +212,35 @@ def test_check_end_conditions_no_winner(complete_game_state):
     complete_game_state.check_end_conditions()
     assert complete_game_state.team_won == Team.UNKNOWN
     assert not isinstance(complete_game_state.current_phase, EndPhase)
+
+
+def test_next_alive_player_skips_dead_and_wraps(complete_game_state):
+    assert complete_game_state.next_alive_player(0) == 1
+    complete_game_state.game_states[1].alive = 0
+    complete_game_state.game_states[2].alive = 0
+    assert complete_game_state.next_alive_player(0) == 3
+    complete_game_state.game_states[0].alive = 0
+    assert complete_game_state.next_alive_player(9) == 3
+
+
+def test_resolve_votes_counts_only_alive_voters(complete_game_state):
+    votes_for = [4, 4, 4, 5, 5, 5, 5, 4, 4, 4]
+    for voter, target in enumerate(votes_for):
+        complete_game_state.game_states[voter].public_data.votes.checks[0].checks[target] = 1
+    # Two of the votes against player 5 come from dead players
+    complete_game_state.game_states[3].alive = 0
+    complete_game_state.game_states[6].alive = 0
+
+    complete_game_state.resolve_votes()
+    assert complete_game_state.game_states[4].alive == 0
+    assert complete_game_state.game_states[5].alive == 1
+    assert not complete_game_state.game_states[0].public_data.votes.checks[0].checks.any()
+
+
+def test_resolve_votes_tie_eliminates_no_one(complete_game_state):
+    for voter in range(MAX_PLAYERS):
+        target = 1 if voter % 2 else 2
+        complete_game_state.game_states[voter].public_data.votes.checks[0].checks[target] = 1
+
+    complete_game_state.resolve_votes()
+    assert all(state.alive for state in complete_game_state.game_states)
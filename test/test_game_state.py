@@ -1,3 +1,6 @@
+import copy
+import pickle
+
 import numpy as np
 import pytest
 
@@ -6,6 +9,7 @@ from mafia_game.game_state import (
     ARRAY_SIZE,
     Checks,
     GameState,
+    MAX_PLAYERS,
     MAX_TURNS,
     PrivateData,
     PublicData,
@@ -82,6 +86,51 @@ def test_sheriff_checks_serialize_full():
     assert np.all(serialized == 0)  # All checks are zeros
 
 
+def test_checks_writes_through_check_rows():
+    checks = Checks()
+    checks.checks[2][4] = 1
+    check = Check()
+    check.checks[7] = 1
+    checks.add_check(check)
+    check[8] = 1  # Writes after adding land in the same storage
+
+    serialized = checks.serialize()
+    assert np.flatnonzero(serialized).tolist() == [7, 8, 24]
+
+
+def test_checks_deserialize_copies_input_into_check_rows():
+    serialized = np.zeros(MAX_PLAYERS * MAX_TURNS, dtype=np.int8)
+    serialized[13] = 1
+    checks = Checks.deserialize(serialized)
+    serialized[13] = 0  # The input buffer is not shared
+    checks.checks[3][5] = 1
+
+    assert checks.checks[1][3] == 1
+    assert np.flatnonzero(checks.serialize()).tolist() == [13, 35]
+
+
+@pytest.mark.parametrize(
+    "duplicate",
+    [copy.deepcopy, lambda checks: pickle.loads(pickle.dumps(checks))],
+    ids=["deepcopy", "pickle"],
+)
+def test_checks_copy_keeps_rows_bound_to_values(duplicate):
+    original = Votes()
+    original.checks[1][6] = 1
+    checks = duplicate(original)
+    checks.checks[2][3] = 1
+
+    assert np.flatnonzero(checks.serialize()).tolist() == [16, 23]
+    assert np.flatnonzero(original.serialize()).tolist() == [16]
+
+
+def test_role_and_team_are_ints_that_print_by_name():
+    assert Role.DON == 3 and Team.RED_TEAM == 2
+    assert Role(np.int8(2)) is Role.MAFIA
+    assert f"{Role.SHERIFF}" == "Role.SHERIFF"
+    assert str(Team.BLACK_TEAM) == "Team.BLACK_TEAM"
+
+
 # Test initialization of GameState
 def test_game_state_initialization():
     private_data = PrivateData(role=Role.CITIZEN)
@@ -84,3 +84,11 @@ def test_get_available_action_classes_night_sheriff_phase(complete_game_state):
     ].private_data.role = Role.SHERIFF
     available_actions = complete_game_state.get_available_action_classes()
     assert set(available_actions) == {SheriffCheckAction}
+
+
+def test_execute_action_rejects_action_not_allowed_in_phase(complete_game_state):
+    complete_game_state.current_phase = DayPhase()
+    with pytest.raises(ValueError):
+        complete_game_state.execute_action(VoteAction(0, 1))
+    complete_game_state.execute_action(NominationAction(0, 1))
+    assert complete_game_state.nominated_players == [1]
@@ -0,0 +1,200 @@
+import random
+
+import pytest
+import torch
+
+from mafia_game.old.models import (
+    GameActionType,
+    GameController,
+    GameState,
+    Player,
+    Policy,
+    Role,
+)
+from mafia_game.old.policies import StaticCitizenPolicy, StaticMafiaPolicy
+
+ACTION_TYPE_NAMES = ("make_declarations", "vote", "kill", "nominate_player")
+
+
+def one_hot(size, index):
+    vector = [0] * size
+    vector[index] = 1
+    return vector
+
+
+def reference_state_vector(game_state, player, action_type, max_actions=100):
+    # The state vector built entry by entry from the logged GameActions
+    num_players = len(game_state.players)
+    vector = [int(action_type == name) for name in ACTION_TYPE_NAMES]
+    vector.append(player.id)
+    for p in game_state.players:
+        vector += [int(p.is_alive), int(p in game_state.nominated_players)]
+
+    actions = [
+        action
+        for action in game_state.game_actions[:max_actions]
+        if action.action_type != GameActionType.VOTE_RESULT
+    ]
+    for action in actions:
+        vector += one_hot(len(GameActionType), action.action_type.index())
+        vector += one_hot(num_players, action.player.id)
+        vector += one_hot(
+            num_players + 1, action.target.id if action.target else num_players
+        )
+        vector += one_hot(
+            len(Role) + 1, action.belief.index() if action.belief else len(Role)
+        )
+
+    action_length = len(GameActionType) + 2 * num_players + 1 + len(Role) + 1
+    vector += [0] * (max_actions - len(actions)) * action_length
+    return torch.tensor(vector, dtype=torch.uint8)
+
+
+class LearningPolicy(Policy):
+    """
+    Plays like the wrapped static policy, and sets an action vector on every
+    decision like a learning policy does, so learners store each transition
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+
+    def decide(self, action_type, game_state, player):
+        player.action_vector = player.action_buffer(action_type, 1)
+        return getattr(self.policy, action_type)(game_state, player)
+
+    def make_declarations(self, game_state, player):
+        return self.decide("make_declarations", game_state, player)
+
+    def vote(self, game_state, player):
+        return self.decide("vote", game_state, player)
+
+    def kill(self, game_state, player):
+        return self.decide("kill", game_state, player)
+
+    def nominate_player(self, game_state, player):
+        return self.decide("nominate_player", game_state, player)
+
+
+class CheckingAgent:
+    """
+    Agent that compares each stored next state, while the log still ends at
+    its action, with the full vector and the reference vector
+    """
+
+    def __init__(self, game_state):
+        self.game_state = game_state
+        # (player id, old state) of every stored transition
+        self.old_states = []
+
+    def store_experience(self, state, action, next_state, reward, action_type):
+        player = self.game_state.players[int(next_state[4])]
+        full = self.game_state.get_state_vector(player, action_type)
+        assert torch.equal(next_state, full)
+        assert torch.equal(
+            full, reference_state_vector(self.game_state, player, action_type)
+        )
+        self.old_states.append((player.id, state))
+
+    def update_policy(self, batch_size, action_type, episode_done, total_reward):
+        pass
+
+
+def new_game_state(learners=True):
+    players = [
+        Player(i, Role.CITIZEN, LearningPolicy(StaticCitizenPolicy()))
+        for i in range(7)
+    ]
+    players += [
+        Player(i, Role.MAFIA, LearningPolicy(StaticMafiaPolicy()))
+        for i in range(7, 10)
+    ]
+    random.shuffle(players)
+    for i, player in enumerate(players):
+        player.id = i
+        player.learner = learners
+    return GameState(players, echo=False)
+
+
+def test_next_state_vectors_match_full_and_reference_vectors():
+    random.seed(0)
+    checked = 0
+    for _ in range(50):
+        game_state = new_game_state()
+        agent = CheckingAgent(game_state)
+        GameController(game_state, agent).start_game()
+        checked += len(agent.old_states)
+
+        for player in game_state.players:
+            for action_type in ACTION_TYPE_NAMES:
+                assert torch.equal(
+                    game_state.get_state_vector(player, action_type),
+                    reference_state_vector(game_state, player, action_type),
+                )
+    assert checked > 0
+
+
+@pytest.mark.parametrize("max_actions", [1, 5])
+def test_game_state_vector_keeps_first_max_actions(max_actions):
+    random.seed(1)
+    game_state = new_game_state(learners=False)
+    GameController(game_state).start_game()
+    assert len(game_state.game_actions) > max_actions
+
+    player = game_state.players[3]
+    vector = game_state.get_game_state_vector(player, max_actions)
+    assert torch.equal(
+        vector,
+        reference_state_vector(game_state, player, None, max_actions)[4:],
+    )
+
+
+class BatchedVotePolicy(LearningPolicy):
+    # Votes like the wrapped policy, with the vote vectors prefetched in batches
+
+    def get_action_vectors(self, state_vectors, action_type):
+        return torch.zeros(len(state_vectors), len(state_vectors[0]))
+
+    def vote(self, game_state, player):
+        player.prefetched_actions.pop("vote")
+        return super().vote(game_state, player)
+
+
+def test_prefetched_votes_store_the_state_at_the_start_of_the_vote():
+    random.seed(2)
+    game_state = new_game_state()
+    for player in game_state.players:
+        player.policy = BatchedVotePolicy(player.policy.policy)
+    controller = GameController(game_state)
+    controller.start_round()
+    game_state.nominate(game_state.players[1])
+    start_states = {
+        player.id: game_state.get_state_vector(player, "vote")
+        for player in game_state.alive_players
+    }
+
+    controller.agent = CheckingAgent(game_state)
+    controller.end_round()
+
+    old_states = controller.agent.old_states
+    assert sorted(player_id for player_id, _ in old_states) == sorted(start_states)
+    for player_id, state in old_states:
+        assert torch.equal(state, start_states[player_id])
+
+
+def test_eliminating_a_dead_player_again_changes_nothing():
+    random.seed(3)
+    game_state = new_game_state(learners=False)
+    citizen = game_state.citizens[0]
+    game_state.eliminate(citizen)
+    alive_mask = game_state.alive_mask
+    state_vector = game_state.get_state_vector(citizen, "vote")
+
+    game_state.eliminate(citizen)
+
+    assert not citizen.is_alive
+    assert game_state.alive_mask == alive_mask
+    assert citizen not in game_state.alive_players
+    assert citizen not in game_state.alive_citizens
+    assert len(game_state.alive_players) == len(game_state.players) - 1
+    assert torch.equal(game_state.get_state_vector(citizen, "vote"), state_vector)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import torch
+
+from mafia_game.old.training import MemmapReplayMemory, ReplayMemory
+
+
+@pytest.fixture(params=["tensors", "memmap"])
+def make_memory(request, tmp_path):
+    def make(capacity):
+        if request.param == "memmap":
+            return MemmapReplayMemory(str(tmp_path / "memory"), capacity)
+        return ReplayMemory(capacity)
+
+    return make
+
+
+def push_transitions(memory, count, start=0):
+    # Every field of transition i holds i, so sampled rows can be matched up
+    for i in range(start, start + count):
+        memory.push(
+            torch.full((4,), i, dtype=torch.uint8),
+            torch.full((3,), float(i)),
+            torch.full((4,), i + 1, dtype=torch.uint8),
+            float(i),
+        )
+
+
+def test_replay_memory_overwrites_oldest_when_full(make_memory):
+    memory = make_memory(5)
+    push_transitions(memory, 8)
+
+    assert len(memory) == 5
+    assert memory.ptr == 3
+    assert sorted(memory.rewards[:5].tolist()) == [3, 4, 5, 6, 7]
+    assert memory.states[:, 0].tolist() == [5, 6, 7, 3, 4]
+
+
+def test_replay_memory_sample_shapes(make_memory):
+    memory = make_memory(10)
+    push_transitions(memory, 6)
+
+    states, actions, next_states, rewards = memory.sample(32)
+
+    assert states.shape == (32, 4) and states.dtype == torch.uint8
+    assert actions.shape == (32, 3) and actions.dtype == torch.float32
+    assert next_states.shape == (32, 4) and next_states.dtype == torch.uint8
+    assert rewards.shape == (32,) and rewards.dtype == torch.float32
+    # Rows of one transition stay together and come from what was pushed
+    assert torch.equal(states[:, 0].float(), rewards)
+    assert torch.equal(actions[:, 0], rewards)
+    assert torch.equal(next_states[:, 0].float(), rewards + 1)
+    assert set(rewards.tolist()) <= set(range(6))
+
+
+def test_memmap_replay_memory_resumes_where_it_stopped(tmp_path):
+    path = str(tmp_path / "memory")
+    push_transitions(MemmapReplayMemory(path, 5), 7)
+
+    memory = MemmapReplayMemory(path, 5)
+    assert len(memory) == 5
+    assert memory.ptr == 2
+
+    push_transitions(memory, 1, start=7)
+    assert sorted(memory.rewards.tolist()) == [3, 4, 5, 6, 7]
+
+
+def test_memmap_replay_memory_rejects_other_capacity(tmp_path):
+    path = str(tmp_path / "memory")
+    push_transitions(MemmapReplayMemory(path, 5), 1)
+
+    with pytest.raises(ValueError, match="capacity 8"):
+        MemmapReplayMemory(path, 8)
+
+
+def test_memmap_replay_memory_rejects_other_state_width(tmp_path):
+    path = str(tmp_path / "memory")
+    push_transitions(MemmapReplayMemory(path, 5), 1)
+    memory = MemmapReplayMemory(path, 5)
+
+    state = torch.zeros(6, dtype=torch.uint8)
+    with pytest.raises(ValueError, match="states"):
+        memory.push(state, torch.zeros(3), state, 0.0)
+
+
+def test_memmap_replay_memory_rejects_column_rewards(tmp_path):
+    path = str(tmp_path / "memory")
+    push_transitions(MemmapReplayMemory(path, 5), 1)
+    # Rewards as stored before they were kept flat
+    np.lib.format.open_memmap(
+        f"{path}.rewards.npy", mode="w+", dtype=np.float32, shape=(5, 1)
+    )
+
+    with pytest.raises(ValueError, match="rewards"):
+        MemmapReplayMemory(path, 5)
@@ -3,6 +3,8 @@ import pytest
 import torch
 from unittest.mock import MagicMock
 
+from mafia_game.train import ReplayBuffer
+
 
 # Define a fixture for the network sizes
 @pytest.fixture
@@ -36,3 +38,38 @@ def mock_game_state():
     )  # Mock serialized state
     return game_state
 
+
+def push_transitions(replay_buffer, count):
+    for i in range(count):
+        replay_buffer.push(
+            np.full(3, i), ("action", i), 0.0, 0, np.full(3, i), False, None, None
+        )
+
+
+def test_replay_buffer_overwrites_oldest_when_full():
+    replay_buffer = ReplayBuffer(capacity=5)
+    push_transitions(replay_buffer, 8)
+
+    assert len(replay_buffer) == 5
+    stored = sorted(transition[1][1] for transition in replay_buffer.buffer)
+    assert stored == [3, 4, 5, 6, 7]
+
+
+def test_replay_buffer_sample_has_no_duplicates():
+    replay_buffer = ReplayBuffer(capacity=10)
+    push_transitions(replay_buffer, 6)
+
+    sample = replay_buffer.sample(6)
+
+    assert sorted(transition[1][1] for transition in sample) == [0, 1, 2, 3, 4, 5]
+
+
+def test_replay_buffer_stores_states_as_int8():
+    replay_buffer = ReplayBuffer(capacity=2)
+    state = np.array([-1.0, 0.0, 9.0])
+    replay_buffer.push(state, ("action", 0), 0.0, 0, state + 1, False, None, None)
+
+    stored_state, _, _, _, stored_next_state, _, _, _ = replay_buffer.buffer[0]
+    assert stored_state.dtype == np.int8
+    assert stored_state.tolist() == [-1, 0, 9]
+    assert stored_next_state.tolist() == [0, 1, 10]